@@ -0,0 +1,337 @@
+"""Offline throughput benchmark for scraper.NAFDACScraper.
+
+Serves a synthetic (or recorded) Greenbook catalogue from a local HTTP server
+and runs a full `scrape_all_products` crawl against it for each catalogue
+size, reporting pages/sec, request latency percentiles, parse cost, peak RSS
+and checkpoint cost. Each crawl runs in its own subprocess so peak RSS is
+measured per size.
+
+    python benchmark_scraper.py --sizes 1000 10000 100000 --latency-ms 20 --error-rate 0.01 --throttle-rate 0.005
+    python benchmark_scraper.py --write-fixtures fixtures/ --sizes 200   # corpus for --check-parser-parity
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+import sqlite3
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+INGREDIENTS_PER_PAGE = 50
+BRANDS_PER_INGREDIENT = 5
+
+DOSAGE_FORMS = ['Tablet', 'Capsule', 'Suspension', 'Syrup', 'Injection', 'Cream']
+COUNTRIES = ['Nigeria', 'India', 'China', 'Germany', 'United Kingdom']
+
+
+class SyntheticCatalogue:
+    """Deterministic Greenbook-like catalogue; pages are rendered on demand."""
+
+    def __init__(self, products: int):
+        self.products = products
+        self.ingredients = max(1, math.ceil(products / BRANDS_PER_INGREDIENT))
+        self.pages = max(1, math.ceil(self.ingredients / INGREDIENTS_PER_PAGE))
+
+    def listing_page(self, page: int) -> Optional[str]:
+        if page < 1 or page > self.pages:
+            return '<html><body><p>No ingredients found.</p></body></html>'
+        first = (page - 1) * INGREDIENTS_PER_PAGE + 1
+        last = min(self.ingredients, first + INGREDIENTS_PER_PAGE - 1)
+        rows = ''.join(
+            f'<li><a href="/ingredient/products/{i}">Ingredient {i}</a></li>' for i in range(first, last + 1))
+        pagination = ''.join(
+            f'<a href="/ingredients?page={p}">{p}</a>' for p in sorted({1, page, self.pages}))
+        if page < self.pages:
+            pagination += f'<a href="/ingredients?page={page + 1}" rel="next">›</a>'
+        return f'<html><body><ul>{rows}</ul><nav class="pagination">{pagination}</nav></body></html>'
+
+    def brand_ids(self, ingredient_id: int) -> range:
+        first = (ingredient_id - 1) * BRANDS_PER_INGREDIENT + 1
+        return range(first, min(self.products, first + BRANDS_PER_INGREDIENT - 1) + 1)
+
+    def ingredient_page(self, ingredient_id: int) -> Optional[str]:
+        if ingredient_id < 1 or ingredient_id > self.ingredients:
+            return None
+        links = ''.join(
+            f'<a href="/products/details/{pid}">Brand {pid} ## {DOSAGE_FORMS[pid % len(DOSAGE_FORMS)]} ** {pid % 50 * 10 + 5}mg</a>'
+            for pid in self.brand_ids(ingredient_id))
+        return f'<html><body><h1>Ingredient {ingredient_id}</h1><div class="products">{links}</div></body></html>'
+
+    def product_page(self, product_id: int) -> Optional[str]:
+        if product_id < 1 or product_id > self.products:
+            return None
+        fields = [
+            ('Manufacturer Name', f'Pharma Works {product_id % 97} Ltd'),
+            ('Manufacturer Country', COUNTRIES[product_id % len(COUNTRIES)]),
+            ('NRN', f'A4-{product_id:05d}' if product_id % 53 else ''),
+            ('Strength', f'{product_id % 50 * 10 + 5}mg' if product_id % 31 else ''),
+            ('Dosage Form', DOSAGE_FORMS[product_id % len(DOSAGE_FORMS)]),
+            ('Pack Size', f'{product_id % 10 + 1}x10'),
+            ('Marketing Category', 'OTC' if product_id % 4 == 0 else 'Prescription'),
+        ]
+        if product_id % 5 == 0:
+            # Older layout handled by the detail-section fallback
+            body = ''.join(
+                f'<div class="detail-section"><h3>{label}</h3><div class="detail-value">{value}</div></div>'
+                for label, value in fields)
+        else:
+            body = ''.join(
+                f'<h1 class="p-1 bg-gray-200 text-left">{label}</h1>\n<p>{value}</p>' for label, value in fields)
+        return (f'<html><head><title>Product {product_id}</title></head><body>'
+                f'<h1>Brand {product_id} {DOSAGE_FORMS[product_id % len(DOSAGE_FORMS)]}</h1>{body}</body></html>')
+
+    def render(self, path: str) -> Optional[str]:
+        match = re.fullmatch(r'/ingredients\?page=(\d+)', path)
+        if match:
+            return self.listing_page(int(match.group(1)))
+        match = re.fullmatch(r'/ingredient/products/(\d+)', path)
+        if match:
+            return self.ingredient_page(int(match.group(1)))
+        match = re.fullmatch(r'/products/details/(\d+)', path)
+        if match:
+            return self.product_page(int(match.group(1)))
+        return None
+
+
+class RecordedPages:
+    """Pages recorded in a scraper response cache (http_cache.db), keyed by path."""
+
+    def __init__(self, cache_file: str):
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def render(self, path: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body FROM responses WHERE url LIKE ? LIMIT 1", ('%' + path,)).fetchone()
+        return zlib.decompress(row[0]).decode('utf-8') if row else None
+
+
+class StandInServer:
+    """Local Greenbook stand-in with injectable latency, 5xx errors and 429 throttling."""
+
+    def __init__(self, catalogue: SyntheticCatalogue, recorded: Optional[RecordedPages] = None,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: int = 1):
+        self.catalogue = catalogue
+        self.recorded = recorded
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.requests = 0
+        self.injected_errors = 0
+        self.injected_throttles = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in.serve(self)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def serve(self, request: BaseHTTPRequestHandler):
+        with self._lock:
+            self.requests += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        roll = random.random()
+        if roll < self.error_rate:
+            with self._lock:
+                self.injected_errors += 1
+            return self._send(request, 503, b'Service Unavailable')
+        if roll < self.error_rate + self.throttle_rate:
+            with self._lock:
+                self.injected_throttles += 1
+            return self._send(request, 429, b'Too Many Requests', {'Retry-After': str(self.retry_after)})
+        body = self.recorded.render(request.path) if self.recorded else None
+        if body is None:
+            body = self.catalogue.render(request.path)
+        if body is None:
+            return self._send(request, 404, b'Not Found')
+        return self._send(request, 200, body.encode('utf-8'), {'Content-Type': 'text/html; charset=utf-8'})
+
+    @staticmethod
+    def _send(request: BaseHTTPRequestHandler, status: int, body: bytes, headers: Optional[Dict[str, str]] = None):
+        request.send_response(status)
+        for name, value in (headers or {}).items():
+            request.send_header(name, value)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_crawl(base_url: str, args: argparse.Namespace) -> Dict:
+    """Run one full crawl in this process (called in a subprocess by `main`)."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from scraper import NAFDACScraper, RetryPolicy
+
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    def record_request(url: str, status: Optional[int], seconds: float):
+        latencies.append(seconds)
+        key = str(status) if status is not None else 'error'
+        statuses[key] = statuses.get(key, 0) + 1
+
+    scraper = NAFDACScraper(
+        max_concurrency=args.concurrency,
+        per_host_concurrency=args.concurrency,
+        retry_policy=RetryPolicy(max_attempts=4, max_elapsed=60.0, backoff_base=0.1, backoff_cap=1.0),
+        initial_rate=args.rate,
+        max_rate=args.rate,
+        min_rate=min(args.rate, 1.0),
+        parser_backend=args.parser,
+        parse_workers=args.parse_workers,
+    )
+    scraper.base_url = base_url
+    scraper.request_hook = record_request
+    scraper.reset_progress()
+
+    started = time.perf_counter()
+    scraped = scraper.scrape_all_products()
+    scraper.save_progress()
+    finalize_started = time.perf_counter()
+    scraper.finalize_output()
+    finalize_seconds = time.perf_counter() - finalize_started
+    elapsed = time.perf_counter() - started
+
+    parse = scraper.stage_stats['parse']
+    checkpoints = scraper.metrics.to_dict()['histograms'].get('checkpoint_seconds', {})
+    return {
+        'products': scraped,
+        'requests': len(latencies),
+        'statuses': statuses,
+        'elapsed_s': round(elapsed, 2),
+        'pages_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'parse_ms_per_page': round(parse.busy / parse.items * 1000, 3) if parse.items else 0.0,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'peak_child_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'checkpoints': checkpoints.get('count', 0),
+        'checkpoint_avg_ms': round(checkpoints.get('avg', 0.0) * 1000, 2),
+        'checkpoint_max_ms': round(checkpoints.get('max', 0.0) * 1000, 2),
+        'finalize_ms': round(finalize_seconds * 1000, 1),
+    }
+
+
+def benchmark_size(size: int, args: argparse.Namespace) -> Dict:
+    catalogue = SyntheticCatalogue(size)
+    recorded = RecordedPages(args.recorded) if args.recorded else None
+    server = StandInServer(catalogue, recorded, latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                           error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+                           retry_after=args.retry_after)
+    server.start()
+    try:
+        with tempfile.TemporaryDirectory(prefix='nafdac-bench-') as workdir:
+            command = [sys.executable, os.path.abspath(__file__), '--run-crawl', server.base_url,
+                       '--concurrency', str(args.concurrency), '--rate', str(args.rate)]
+            if args.parser:
+                command += ['--parser', args.parser]
+            if args.parse_workers is not None:
+                command += ['--parse-workers', str(args.parse_workers)]
+            output = subprocess.run(command, cwd=workdir, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+    finally:
+        server.stop()
+    result['size'] = size
+    result['injected_errors'] = server.injected_errors
+    result['injected_throttles'] = server.injected_throttles
+    return result
+
+
+def write_fixtures(directory: str, size: int):
+    catalogue = SyntheticCatalogue(size)
+    os.makedirs(directory, exist_ok=True)
+    for product_id in range(1, size + 1):
+        with open(os.path.join(directory, f"{product_id}.html"), 'w', encoding='utf-8') as f:
+            f.write(catalogue.product_page(product_id))
+    print(f"Wrote {size} product pages to {directory}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark NAFDACScraper against a local Greenbook stand-in.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help="Catalogue sizes (products) to crawl (default: 1000 10000 100000)")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Server latency per request")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="Extra random latency per request")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument('--recorded', metavar='CACHE_DB',
+                        help="Serve pages recorded in a scraper response cache, falling back to synthetic pages")
+    parser.add_argument('--concurrency', type=int, default=16, help="Scraper concurrency (default: 16)")
+    parser.add_argument('--rate', type=float, default=10000.0,
+                        help="Scraper request rate cap; high by default to measure raw throughput")
+    parser.add_argument('--parser', default=None, help="Parser backend passed to the scraper")
+    parser.add_argument('--parse-workers', type=int, default=None, help="Parser processes passed to the scraper")
+    parser.add_argument('--json', action='store_true', help="Print results as JSON lines")
+    parser.add_argument('--write-fixtures', metavar='DIR',
+                        help="Write synthetic product pages for --check-parser-parity (uses the first size) and exit")
+    parser.add_argument('--run-crawl', metavar='BASE_URL', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    if args.run_crawl:
+        print(json.dumps(run_crawl(args.run_crawl, args)))
+        return
+    if args.write_fixtures:
+        write_fixtures(args.write_fixtures, args.sizes[0])
+        return
+
+    columns = ['size', 'requests', 'elapsed_s', 'pages_per_s', 'latency_p50_ms', 'latency_p99_ms',
+               'parse_ms_per_page', 'peak_rss_mb', 'checkpoint_avg_ms', 'checkpoint_max_ms', 'finalize_ms']
+    if not args.json:
+        print(' '.join(f"{column:>17}" for column in columns))
+    for size in args.sizes:
+        result = benchmark_size(size, args)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(' '.join(f"{result[column]:>17}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+// Reader for the prebuilt search index written by `scraper.py --search-index DIR`.
+// Shards are fetched lazily through `loadShard`, so the index can be read from
+// the filesystem on the server or served from `public/` and fetched in the browser.
+
+export const SEARCH_FIELDS = ['brandName', 'genericName', 'manufacturer', 'nafdacNumber', 'strength'] as const;
+const JOINED_SEARCH_FIELDS = new Set(['nafdacNumber', 'strength']);
+const VERIFY_LIMIT = 256;
+
+export type SearchDocument = Record<(typeof SEARCH_FIELDS)[number], string> & { id: string };
+
+interface Manifest {
+  version: number;
+  doc_shards: number;
+  documents: number;
+}
+
+interface TermShard {
+  terms: string[];
+  postings: number[][];
+}
+
+// Same normalisation as search_tokens() in scraper.py.
+export function searchTokens(text: string | null | undefined): string[] {
+  if (!text) return [];
+  return text.normalize('NFKD').replace(/[^\x00-\x7f]/g, '').toLowerCase().match(/[a-z0-9]+/g) ?? [];
+}
+
+function shardChar(term: string): string {
+  return /^[0-9a-z]/.test(term) ? term[0] : '_';
+}
+
+function trigrams(term: string): string[] {
+  const result = new Set<string>();
+  for (let i = 0; i + 3 <= term.length; i++) result.add(term.slice(i, i + 3));
+  return Array.from(result);
+}
+
+function deltaDecode(encoded: number[]): number[] {
+  let previous = 0;
+  return encoded.map((delta) => (previous += delta));
+}
+
+function bisectLeft(terms: string[], target: string, lo = 0): number {
+  let hi = terms.length;
+  while (lo < hi) {
+    const mid = (lo + hi) >> 1;
+    if (terms[mid] < target) lo = mid + 1;
+    else hi = mid;
+  }
+  return lo;
+}
+
+function documentTerms(document: string[]): Set<string> {
+  const terms = new Set<string>();
+  SEARCH_FIELDS.forEach((field, i) => {
+    const tokens = searchTokens(document[i]);
+    tokens.forEach((token) => terms.add(token));
+    if (JOINED_SEARCH_FIELDS.has(field) && tokens.length > 1) terms.add(tokens.join(''));
+  });
+  return terms;
+}
+
+export class SearchIndex {
+  private manifest?: Promise<Manifest>;
+  private shards = new Map<string, Promise<unknown>>();
+
+  constructor(private loadShard: (name: string) => Promise<unknown | null>) {}
+
+  private shard<T>(name: string, fallback: T): Promise<T> {
+    if (!this.shards.has(name)) {
+      this.shards.set(name, this.loadShard(name).then((data) => (data ?? fallback) as T));
+    }
+    return this.shards.get(name) as Promise<T>;
+  }
+
+  private async terms(char: string): Promise<TermShard> {
+    return this.shard<TermShard>(`terms-${char}.json`, { terms: [], postings: [] });
+  }
+
+  private async prefixRange(token: string): Promise<[TermShard, number, number]> {
+    const shard = await this.terms(shardChar(token));
+    const lo = bisectLeft(shard.terms, token);
+    return [shard, lo, bisectLeft(shard.terms, token + '\x7f', lo)];
+  }
+
+  private async rawDocument(id: number): Promise<string[] | undefined> {
+    this.manifest ??= this.shard<Manifest>('manifest.json', { version: 1, doc_shards: 16, documents: 0 });
+    const { doc_shards } = await this.manifest;
+    const name = `docs-${String(id % doc_shards).padStart(2, '0')}.json`;
+    return (await this.shard<Record<string, string[]>>(name, {}))[String(id)];
+  }
+
+  async document(id: number): Promise<SearchDocument | null> {
+    const document = await this.rawDocument(id);
+    if (!document) return null;
+    const result = { id: String(id) } as SearchDocument;
+    SEARCH_FIELDS.forEach((field, i) => (result[field] = document[i]));
+    return result;
+  }
+
+  private async match(token: string): Promise<[Set<number>, Set<number>]> {
+    const [shard, lo, hi] = await this.prefixRange(token);
+    const matched = new Set<number>();
+    if (lo < hi) {
+      for (let i = lo; i < hi; i++) deltaDecode(shard.postings[i]).forEach((id) => matched.add(id));
+      const exact = shard.terms[lo] === token ? new Set(deltaDecode(shard.postings[lo])) : new Set<number>();
+      return [matched, exact];
+    }
+    if (token.length < 3) return [matched, new Set()];
+    let candidates: Set<string> | null = null;
+    for (const trigram of trigrams(token)) {
+      const shardTerms = await this.shard<Record<string, string[]>>(`trigrams-${shardChar(trigram)}.json`, {});
+      const found: string[] = shardTerms[trigram] ?? [];
+      candidates = candidates === null ? new Set(found) : new Set(found.filter((term) => candidates!.has(term)));
+      if (candidates.size === 0) return [matched, new Set()];
+    }
+    for (const term of Array.from(candidates ?? [])) {
+      if (!term.includes(token)) continue;
+      const [termShard, termLo, termHi] = await this.prefixRange(term);
+      if (termLo < termHi && termShard.terms[termLo] === term) {
+        deltaDecode(termShard.postings[termLo]).forEach((id) => matched.add(id));
+      }
+    }
+    return [matched, new Set()];
+  }
+
+  private async filter(results: Set<number>, token: string): Promise<[Set<number>, Set<number>]> {
+    const [, lo, hi] = await this.prefixRange(token);
+    const matched = new Set<number>();
+    const exact = new Set<number>();
+    if (lo === hi && token.length < 3) return [matched, exact];
+    for (const id of Array.from(results)) {
+      const terms = Array.from(documentTerms((await this.rawDocument(id)) ?? []));
+      if (lo < hi) {
+        if (terms.some((term) => term.startsWith(token))) {
+          matched.add(id);
+          if (terms.includes(token)) exact.add(id);
+        }
+      } else if (terms.some((term) => term.includes(token))) {
+        matched.add(id);
+      }
+    }
+    return [matched, exact];
+  }
+
+  // Products matching every query token; whole-term matches rank first.
+  async search(query: string, limit = 20): Promise<SearchDocument[]> {
+    const tokens = Array.from(new Set(searchTokens(query))).sort((a, b) => b.length - a.length);
+    let results: Set<number> | null = null;
+    const exactHits = new Map<number, number>();
+    for (const token of tokens) {
+      const [matched, exact]: [Set<number>, Set<number>] =
+        results !== null && results.size <= VERIFY_LIMIT ? await this.filter(results, token) : await this.match(token);
+      const current: Set<number> | null = results;
+      results = current === null ? matched : new Set(Array.from(matched).filter((id) => current.has(id)));
+      if (results.size === 0) return [];
+      exact.forEach((id) => exactHits.set(id, (exactHits.get(id) ?? 0) + 1));
+    }
+    if (!results) return [];
+    const ranked = Array.from(results)
+      .sort((a, b) => (exactHits.get(b) ?? 0) - (exactHits.get(a) ?? 0) || a - b)
+      .slice(0, limit);
+    return (await Promise.all(ranked.map((id) => this.document(id)))).filter((doc): doc is SearchDocument => doc !== null);
+  }
+}
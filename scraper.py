@@ -6,32 +6,2409 @@ import random
 from datetime import datetime
 import re
 import os
+import csv
+import argparse
+import hashlib
+import bisect
+import itertools
+import unicodedata
+import mmap
+import struct
+import logging
+import socket
+import sqlite3
+import zlib
+import textwrap
+import threading
+import multiprocessing
+from email.utils import parsedate_to_datetime
+from array import array
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
 from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from typing import Dict, List, Optional, Tuple
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger('nafdac_scraper')
+
+_EXHAUSTED = object()
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """Retry budget for a single request, bounded by attempt count and total elapsed time.
+
+    Backoff uses "full jitter": the n-th retry waits a random delay between 0 and
+    min(backoff_cap, backoff_base * 2**n) seconds.
+    """
+
+    def __init__(self, max_attempts: int = 4, max_elapsed: float = 60.0,
+                 backoff_base: float = 1.0, backoff_cap: float = 20.0):
+        self.max_attempts = max(1, max_attempts)
+        self.max_elapsed = max_elapsed
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    def backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** (attempt - 1))))
+
+    def allows_retry(self, attempt: int, started: float, delay: float) -> bool:
+        """Whether another attempt fits the budget after `attempt` failed attempts."""
+        if attempt >= self.max_attempts:
+            return False
+        return (time.monotonic() - started) + delay < self.max_elapsed
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class AdaptiveRateLimiter:
+    """Token bucket whose refill rate (requests/second) adapts with AIMD.
+
+    Every healthy response raises the rate by `additive_increase` up to
+    `max_rate`. Throttling signals (429/5xx, timeouts, connection errors, or a
+    response slower than `latency_spike` times the latency moving average, and
+    at least `latency_floor` seconds slower) cut it by `decrease_factor`, down
+    to `min_rate`. Decreases are spaced at least `decrease_cooldown` seconds
+    apart so a burst of in-flight failures only counts once. A Retry-After value empties the bucket until it expires.
+    """
+
+    def __init__(self, rate: float = 2.0, min_rate: float = 0.2, max_rate: float = 20.0,
+                 burst: float = 2.0, additive_increase: float = 0.05, decrease_factor: float = 0.5,
+                 latency_spike: float = 3.0, latency_floor: float = 1.0, decrease_cooldown: float = 2.0):
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.burst = max(1.0, burst)
+        self.additive_increase = additive_increase
+        self.decrease_factor = decrease_factor
+        self.latency_spike = latency_spike
+        self.latency_floor = latency_floor
+        self.decrease_cooldown = decrease_cooldown
+        self.increases = 0
+        self.decreases = 0
+        self.retry_after_pauses = 0
+        self.peak_rate = self.rate
+        self.latency_ewma: Optional[float] = None
+        self.adjustments = deque(maxlen=500)
+        self._tokens = self.burst
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self, latency: float):
+        with self._lock:
+            if (self.latency_ewma is not None and latency > self.latency_spike * self.latency_ewma
+                    and latency - self.latency_ewma > self.latency_floor):
+                self._decrease(f"latency spike ({latency:.2f}s vs {self.latency_ewma:.2f}s avg)")
+            elif self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.additive_increase)
+                self.peak_rate = max(self.peak_rate, self.rate)
+                self.increases += 1
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+
+    def on_throttle(self, reason: str, retry_after: Optional[float] = None):
+        with self._lock:
+            self._decrease(reason)
+            if retry_after:
+                self.retry_after_pauses += 1
+                self._tokens = 0.0
+                self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+                self.adjustments.append((datetime.now().isoformat(), self.rate, self.rate, f"Retry-After {retry_after:.0f}s"))
+
+    def _decrease(self, reason: str):
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        old_rate = self.rate
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.decreases += 1
+        self.adjustments.append((datetime.now().isoformat(), old_rate, self.rate, reason))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'rate': round(self.rate, 3),
+                'min_rate': self.min_rate,
+                'max_rate': self.max_rate,
+                'peak_rate': round(self.peak_rate, 3),
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'retry_after_pauses': self.retry_after_pauses,
+                'latency_ewma': round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+                'adjustments': [
+                    {'time': when, 'from': round(old, 3), 'to': round(new, 3), 'reason': reason}
+                    for when, old, new, reason in self.adjustments
+                ],
+            }
+
+
+class CircuitBreaker:
+    """Host-level circuit breaker.
+
+    While closed, the outcome of every request is tracked over a sliding window.
+    When the error rate in the window reaches `failure_threshold`, the breaker
+    opens and every caller of `acquire` blocks, pausing the crawl. After the
+    cooldown it goes half-open and lets single probe requests through; once
+    `probe_successes` probes in a row succeed it closes again, while a failed
+    probe re-opens it with a doubled cooldown (capped at `max_cooldown`).
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, window: int = 20, min_samples: int = 10, failure_threshold: float = 0.5,
+                 cooldown: float = 30.0, max_cooldown: float = 600.0, probe_successes: int = 2):
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_successes = probe_successes
+        self.state = self.CLOSED
+        self.trips = 0
+        self._cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._open_until = 0.0
+        self._probe_in_flight = False
+        self._probe_streak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> bool:
+        """Block until a request may be sent. Returns True if the request is a probe."""
+        with self._cond:
+            while True:
+                if self.state == self.CLOSED:
+                    return False
+                if self.state == self.OPEN:
+                    remaining = self._open_until - time.monotonic()
+                    if remaining > 0:
+                        self._cond.wait(remaining)
+                        continue
+                    self.state = self.HALF_OPEN
+                if not self._probe_in_flight:
+                    self._probe_in_flight = True
+                    return True
+                self._cond.wait()
+
+    def record(self, success: bool, probe: bool = False):
+        with self._cond:
+            if probe:
+                self._probe_in_flight = False
+                if success:
+                    self._probe_streak += 1
+                    if self._probe_streak >= self.probe_successes:
+                        logger.info("Circuit breaker closed, resuming crawl")
+                        self.state = self.CLOSED
+                        self._cooldown = self.base_cooldown
+                        self._outcomes.clear()
+                else:
+                    self._trip(min(self._cooldown * 2, self.max_cooldown))
+                self._cond.notify_all()
+                return
+            if self.state != self.CLOSED:
+                # Stragglers sent before the breaker opened don't count.
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_samples and failures / len(self._outcomes) >= self.failure_threshold:
+                self._trip(self._cooldown)
+
+    def _trip(self, cooldown: float):
+        self._cooldown = cooldown
+        self.state = self.OPEN
+        self.trips += 1
+        self._probe_streak = 0
+        self._open_until = time.monotonic() + cooldown
+        logger.warning("Circuit breaker open, pausing crawl for %.0fs", cooldown)
+
+# --- Product page parsing -------------------------------------------------
+
+try:
+    import lxml.html
+except ImportError:  # optional: fast-path parser backend
+    lxml = None
+
+LABELLED_H1_CLASS = "p-1 bg-gray-200 text-left"
+# Bump whenever extraction changes, so parsed records cached by ResponseCache are parsed again.
+EXTRACTION_VERSION = 1
+
+SECTION_VALUE_KEYWORDS = ('manufacturer name', 'company name', 'nrn', 'registration number', 'strength',
+                          'dosage form', 'manufacturer country', 'country of origin', 'packsize')
+MANUFACTURER_KEYWORDS = ('manufacturer name', 'company name', 'producer', 'produced by', 'manufactured by')
+NAFDAC_NUMBER_KEYWORDS = ('nrn', 'registration number', 'reg. no', 'reg no', 'nafdac reg')
+COUNTRY_KEYWORDS = ('manufacturer country', 'country of origin', 'country of manufacture', 'made in')
+
+MANUFACTURER_PATTERNS = [re.compile(pattern) for pattern in (
+    r'^([A-Z][A-Za-z\s.,\'&-]+)(?=\s+\d)',
+    r'^([A-Z][A-Za-z\s.,\'&-]+)(?=\s+(?:Tablet|Capsule|Suspension|Syrup|Injection|Cream|Ointment|Gel|Powder|Solution|Drops|Spray|Inhaler|Patch|Suppository|Enema|Aerosol))',
+    r'^([A-Z][A-Za-z\s.,\'&-]+)(?=\s+(?:mg|g|ml|IU|mcg|µg|%|w/v|w/w))',
+    r'^([A-Z][A-Za-z\s.,\'&-]+)(?=\s+(?:Plus|Extra|Forte|SR|XR|CR|MR|LA|DS))',
+)]
+STRENGTH_PATTERN = re.compile(r'(\d+(?:\.\d+)?\s*(?:mg|g|ml|IU|mcg|µg|%|w/v|w/w)(?:\s*/\s*\d*\.?\d*\s*(?:ml|dose|actuation))?)', re.IGNORECASE)
+DOSAGE_FORM_PATTERN = re.compile(r'(tablet|capsule|suspension|syrup|injection|cream|ointment|gel|powder|solution|drops|spray|inhaler|patch|suppository|enema|aerosol|lozenge|granules|effervescent|oral liquid|oral solution|oral suspension|oral drops|oral powder|for injection|for solution|for suspension)', re.IGNORECASE)
+
+
+def normalize_text(text: Optional[str]) -> str:
+    if not text:
+        return ''
+    return ' '.join(text.replace('\xa0', ' ').split())
+
+
+def new_product_record(product_id: str) -> Dict:
+    return {
+        'id': product_id,
+        'brandName': '',
+        'manufacturer': '',
+        'nafdacNumber': '',
+        'type': 'prescription', 
+        'dateAdded': datetime.now().strftime('%Y-%m-%d'),
+        'verified': True,
+        'rating': 4.0,
+        'bioequivalence': 'pending',
+        'countryOfOrigin': 'Nigeria', # Default
+        'strength': '',
+        'dosageForm': '',
+        'packSize': '',
+        'image': '/placeholder.svg',
+        'suppliers': []
+    }
+
+
+def apply_labelled_value(product_data: Dict, label: str, value: str):
+    """Apply an `<h1 class="p-1 bg-gray-200 text-left">` label and the text of its next `<p>`."""
+    if "manufacturer name" in label:
+        product_data['manufacturer'] = value
+    elif "manufacturer country" in label:
+        product_data['countryOfOrigin'] = value
+    elif "nrn" in label or "registration number" in label:
+        product_data['nafdacNumber'] = value
+    elif "packsize" in label or "pack size" in label:
+        product_data['packSize'] = value
+    elif "strength" in label:
+        product_data['strength'] = value
+    elif "dosage form" in label:
+        product_data['dosageForm'] = value
+    elif "marketing category" in label:
+        category = value.lower()
+        product_data['type'] = 'otc' if 'otc' in category else 'prescription'
+
+
+def apply_section_value(product_data: Dict, title_text: str, value_text: str):
+    """Apply a `detail-section` title/value pair; fields already found are kept."""
+    title_text_lower = title_text.lower()
+    if not value_text and ':' in title_text:
+        parts = title_text.split(':', 1)
+        if len(parts) > 1 and normalize_text(parts[1].strip()):
+            if any(keyword in title_text_lower for keyword in SECTION_VALUE_KEYWORDS):
+                value_text = normalize_text(parts[1].strip())
+    if any(x in title_text_lower for x in MANUFACTURER_KEYWORDS):
+        if not product_data['manufacturer']:
+            product_data['manufacturer'] = value_text
+    elif any(x in title_text_lower for x in NAFDAC_NUMBER_KEYWORDS):
+        if not product_data['nafdacNumber']:
+            product_data['nafdacNumber'] = value_text
+    elif 'strength' in title_text_lower:
+        if not product_data['strength']:
+            product_data['strength'] = value_text
+    elif 'dosage form' in title_text_lower:
+        if not product_data['dosageForm']:
+            product_data['dosageForm'] = value_text
+    elif 'marketing category' in title_text_lower:
+        category = value_text.lower()
+        product_data['type'] = 'otc' if 'otc' in category else 'prescription'
+    elif any(x in title_text_lower for x in COUNTRY_KEYWORDS):
+        if value_text and not product_data['countryOfOrigin']:
+            product_data['countryOfOrigin'] = value_text
+    elif 'packsize' in title_text_lower or 'pack size' in title_text_lower:
+        if not product_data['packSize']:
+            product_data['packSize'] = value_text
+
+
+def value_after_title(texts: List[str], title_text_lower: str) -> str:
+    """The string following the section title among a section's normalized strings."""
+    for i, text in enumerate(texts):
+        if text.lower() == title_text_lower:
+            return texts[i + 1] if i + 1 < len(texts) else ''
+    return ''
+
+
+def apply_brand_name_fallbacks(product_data: Dict):
+    """Fill manufacturer, strength and dosage form from the brand name when the page had none."""
+    brand_name = product_data['brandName']
+    # Fallback for manufacturer if still not found by section parsing
+    if not product_data['manufacturer']:
+        for pattern in MANUFACTURER_PATTERNS:
+            manufacturer_match = pattern.search(brand_name)
+            if manufacturer_match:
+                potential_manufacturer = manufacturer_match.group(1).strip()
+                if len(potential_manufacturer) > 3 and (' ' in potential_manufacturer or potential_manufacturer.endswith(('.', 'Ltd', 'Inc', 'PLC'))):
+                    product_data['manufacturer'] = potential_manufacturer
+                    break
+    if not product_data['strength']:
+        strength_match = STRENGTH_PATTERN.search(brand_name)
+        if strength_match:
+            product_data['strength'] = strength_match.group(1)
+    if not product_data['dosageForm']:
+        dosage_match = DOSAGE_FORM_PATTERN.search(brand_name)
+        if dosage_match:
+            product_data['dosageForm'] = dosage_match.group(1).capitalize()
+
+
+class ProductPageParser:
+    """Extracts a product record from a `/products/details/<id>` page."""
+
+    name = ''
+
+    @property
+    def version(self) -> str:
+        """Identifies the records this parser produces, for ResponseCache.parser_version."""
+        return f"{self.name}/{EXTRACTION_VERSION}"
+
+    def parse(self, product_id: str, content: str) -> Dict:
+        raise NotImplementedError
+
+
+class SoupProductParser(ProductPageParser):
+    """Reference implementation on a full BeautifulSoup tree."""
+
+    name = 'soup'
+
+    def parse(self, product_id: str, content: str) -> Dict:
+        soup = BeautifulSoup(content, 'html.parser')
+        product_data = new_product_record(product_id)
+
+        name_elem = soup.find('h1')
+        if name_elem:
+            product_data['brandName'] = normalize_text(name_elem.text)
+
+        # Labelled fields: <h1 class="p-1 bg-gray-200 text-left"> followed by a <p> value
+        for h1 in soup.find_all("h1", class_=LABELLED_H1_CLASS):
+            label = h1.get_text(strip=True).lower()
+            value_tag = h1.find_next_sibling("p")
+            value = value_tag.get_text(strip=True) if value_tag else ""
+            apply_labelled_value(product_data, label, value)
+
+        # Fallback for older layouts: <div class="detail-section"><h3>title</h3>...value...</div>
+        for section in soup.find_all('div', class_='detail-section'):
+            title_tag = section.find('h3')
+            if not title_tag:
+                continue
+            title_text = normalize_text(title_tag.text)
+            value_text = ''
+            detail_value_div = section.find('div', class_='detail-value')
+            if detail_value_div:
+                value_text = normalize_text(detail_value_div.text)
+            if not value_text:
+                for sibling in title_tag.find_next_siblings():
+                    if sibling.name in ('p', 'span', 'div'):
+                        value_text = normalize_text(sibling.text)
+                        if value_text:
+                            break
+            if not value_text:
+                texts = [normalize_text(t) for t in section.stripped_strings if normalize_text(t)]
+                value_text = value_after_title(texts, title_text.lower())
+            apply_section_value(product_data, title_text, value_text)
+
+        apply_brand_name_fallbacks(product_data)
+        return product_data
+
+
+# Text inside these tags is not document text (BeautifulSoup skips it too).
+_NON_TEXT_TAGS = frozenset(('script', 'style', 'template'))
+
+
+def _lxml_strings(element) -> Iterator[str]:
+    if element.tag in _NON_TEXT_TAGS:
+        return
+    if element.text:
+        yield element.text
+    for child in element:
+        if isinstance(child.tag, str):
+            yield from _lxml_strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def _lxml_text(element) -> str:
+    return ''.join(_lxml_strings(element))
+
+
+def _has_class(element, class_name: str) -> bool:
+    return class_name in element.get('class', '').split()
+
+
+class LxmlProductParser(ProductPageParser):
+    """Fast path: builds the tree with lxml and collects every label/value
+    candidate in a single pass over the `<h1>` and `<div>` elements."""
+
+    name = 'lxml'
+
+    def parse(self, product_id: str, content: str) -> Dict:
+        if not content.strip():
+            content = '<html></html>'
+        try:
+            root = lxml.html.document_fromstring(content)
+        except ValueError:
+            # Unicode input with an XML encoding declaration
+            root = lxml.html.document_fromstring(content.encode('utf-8'), parser=lxml.html.HTMLParser(encoding='utf-8'))
+        product_data = new_product_record(product_id)
+
+        first_h1 = None
+        labelled = []
+        sections = []
+        for element in root.iter('h1', 'div'):
+            if element.tag == 'h1':
+                if first_h1 is None:
+                    first_h1 = element
+                if ' '.join(element.get('class', '').split()) == LABELLED_H1_CLASS:
+                    labelled.append(element)
+            elif _has_class(element, 'detail-section'):
+                sections.append(element)
+
+        if first_h1 is not None:
+            product_data['brandName'] = normalize_text(_lxml_text(first_h1))
+
+        for h1 in labelled:
+            label = ''.join(t.strip() for t in _lxml_strings(h1)).lower()
+            value_tag = next(h1.itersiblings('p'), None)
+            value = ''.join(t.strip() for t in _lxml_strings(value_tag)) if value_tag is not None else ""
+            apply_labelled_value(product_data, label, value)
+
+        for section in sections:
+            title_tag = next(section.iter('h3'), None)
+            if title_tag is None:
+                continue
+            title_text = normalize_text(_lxml_text(title_tag))
+            value_text = ''
+            detail_value_div = next((div for div in section.iter('div') if div is not section and _has_class(div, 'detail-value')), None)
+            if detail_value_div is not None:
+                value_text = normalize_text(_lxml_text(detail_value_div))
+            if not value_text:
+                for sibling in title_tag.itersiblings('p', 'span', 'div'):
+                    value_text = normalize_text(_lxml_text(sibling))
+                    if value_text:
+                        break
+            if not value_text:
+                texts = [normalize_text(t) for t in _lxml_strings(section) if normalize_text(t)]
+                value_text = value_after_title(texts, title_text.lower())
+            apply_section_value(product_data, title_text, value_text)
+
+        apply_brand_name_fallbacks(product_data)
+        return product_data
+
+
+PARSER_BACKENDS = {
+    SoupProductParser.name: SoupProductParser,
+    LxmlProductParser.name: LxmlProductParser,
+}
+
+
+def make_parser(backend: Optional[str] = None) -> ProductPageParser:
+    """Build a parser backend; defaults to lxml when it is installed."""
+    backend = backend or ('lxml' if lxml is not None else 'soup')
+    if backend == 'lxml' and lxml is None:
+        logger.warning("lxml is not installed, falling back to the BeautifulSoup parser")
+        backend = 'soup'
+    return PARSER_BACKENDS[backend]()
+
+
+def compare_parsers(pages: Iterable[Tuple[str, str]], reference: ProductPageParser,
+                    candidate: ProductPageParser) -> Tuple[int, List[Tuple[str, str, object, object]]]:
+    """Parse each (product_id, html) page with both backends.
+
+    Returns the number of pages compared and a list of
+    (product_id, field, reference value, candidate value) mismatches.
+    """
+    compared = 0
+    mismatches = []
+    for product_id, content in pages:
+        try:
+            expected = reference.parse(product_id, content)
+        except Exception as e:
+            expected = {'error': type(e).__name__}
+        try:
+            actual = candidate.parse(product_id, content)
+        except Exception as e:
+            actual = {'error': type(e).__name__}
+        compared += 1
+        for field in sorted(set(expected) | set(actual)):
+            if expected.get(field) != actual.get(field):
+                mismatches.append((product_id, field, expected.get(field), actual.get(field)))
+    return compared, mismatches
+
+
+def iter_fixture_pages(directory: str) -> Iterator[Tuple[str, str]]:
+    """Yield (product_id, html) for every `<product_id>.html` file in `directory`."""
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.html'):
+            with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                yield name[:-len('.html')], f.read()
+
+
+_WORKER_PARSERS: Dict[str, ProductPageParser] = {}
+
+
+def parse_product_page(backend: str, product_id: str, content: str) -> Tuple[Optional[Dict], float, Optional[str]]:
+    """Parse stage entry point; runs in a worker process, so the parser is built once per process.
+
+    Returns (product record or None, parse seconds, error message).
+    """
+    parser = _WORKER_PARSERS.get(backend)
+    if parser is None:
+        parser = _WORKER_PARSERS[backend] = make_parser(backend)
+    started = time.perf_counter()
+    try:
+        return parser.parse(product_id, content), time.perf_counter() - started, None
+    except Exception as e:
+        return None, time.perf_counter() - started, str(e)
+
+
+def completed_future(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class StageStats:
+    """Throughput counters for one pipeline stage.
+
+    `busy` is the summed per-item work time; divided by the stage's worker count
+    and the elapsed time it gives the stage utilisation, so the stage closest
+    to 100% is the bottleneck. `queued` is the number of items in flight.
+    """
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.items = 0
+        self.busy = 0.0
+        self.queued = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.items += 1
+            self.busy += seconds
+
+    def report(self, elapsed: float) -> str:
+        with self._lock:
+            items, busy = self.items, self.busy
+        rate = items / elapsed if elapsed > 0 else 0.0
+        per_item = busy / items * 1000 if items else 0.0
+        utilisation = busy / (elapsed * self.workers) * 100 if elapsed > 0 else 0.0
+        return (f"{self.name}: {items} items, {rate:.1f}/s, {per_item:.1f} ms/item, "
+                f"{utilisation:.0f}% busy, {self.queued} in flight")
+
+
+def atomic_write_json(path: str, data, **dump_kwargs):
+    """Write JSON to a temp file, fsync it and rename it over `path`."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, **dump_kwargs)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ProductStreamWriter:
+    """Append-only JSONL product output.
+
+    Each product is written as one line with a single write and flushed, so a
+    crash loses at most the line being written; `sync` fsyncs at checkpoints.
+    Reopening for append truncates any partial trailing line left by a crash.
+    `finalize` turns the stream into the legacy `nafdac_products.json` array.
+    """
+
+    def __init__(self, path: str = 'nafdac_products.jsonl'):
+        self.path = path
+        self.count = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with open(self.path, 'w', encoding='utf-8'):
+            pass
+
+    def open(self):
+        if self._file:
+            return
+        self._repair_tail()
+        self.count = self._count_lines()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def write(self, product: Dict):
+        line = json.dumps(product, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.count += 1
+
+    def sync(self):
+        with self._lock:
+            if self._file:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _repair_tail(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            pos, end = size, 0
+            while pos > 0:
+                step = min(65536, pos)
+                pos -= step
+                f.seek(pos)
+                newline = f.read(step).rfind(b'\n')
+                if newline != -1:
+                    end = pos + newline + 1
+                    break
+            if end != size:
+                logger.warning("Truncating partial record at the end of %s", self.path)
+                f.truncate(end)
+
+    def _count_lines(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        count = 0
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                count += chunk.count(b'\n')
+        return count
+
+    def iter_products(self) -> Iterator[Dict]:
+        """Yield products in stream order; a later record for an ID replaces earlier ones."""
+        if not os.path.exists(self.path):
+            return
+        last_line = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f):
+                last_line[json.loads(line)['id']] = line_no
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f):
+                product = json.loads(line)
+                if last_line[product['id']] == line_no:
+                    yield product
+
+    def finalize(self, output_path: str = 'nafdac_products.json') -> int:
+        """Write the legacy JSON array (as json.dump(..., indent=2) would) atomically."""
+        self.sync()
+        tmp_path = f"{output_path}.tmp"
+        written = 0
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            out.write('[')
+            for product in self.iter_products():
+                out.write('\n' if written == 0 else ',\n')
+                out.write(textwrap.indent(json.dumps(product, ensure_ascii=False, indent=2), '  '))
+                written += 1
+            out.write('\n]' if written else ']')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, output_path)
+        return written
+
+
+# Quality fields in bit order, with their score weight and validation label
+# (None: scored but not required).
+QUALITY_FIELDS = (
+    ('manufacturer', 0.25, 'Manufacturer Name'),
+    ('nafdacNumber', 0.25, 'NAFDAC Registration Number'),
+    ('brandName', 0.15, 'Brand Name'),
+    ('strength', 0.15, 'Strength'),
+    ('dosageForm', 0.10, 'Dosage Form'),
+    ('packSize', 0.05, None),
+    ('countryOfOrigin', 0.05, None),
+)
+FIELD_BITS = {field: 1 << bit for bit, (field, _, _) in enumerate(QUALITY_FIELDS)}
+REQUIRED_FIELDS = tuple((field, label) for field, _, label in QUALITY_FIELDS if label)
+# validation_log key -> field
+VALIDATION_LOG_FIELDS = {
+    'missing_manufacturer': 'manufacturer',
+    'missing_nafdac': 'nafdacNumber',
+    'missing_strength': 'strength',
+    'missing_dosage_form': 'dosageForm',
+}
+
+
+def _score_for_mask(mask: int) -> float:
+    # Summed in field order, so scores equal the per-field sum exactly.
+    score = 0.0
+    for field, weight, _ in QUALITY_FIELDS:
+        if mask & FIELD_BITS[field]:
+            score += weight
+    return score
+
+
+SCORE_TABLE = tuple(_score_for_mask(mask) for mask in range(256))
+ALL_FIELDS_MASK = (1 << len(QUALITY_FIELDS)) - 1
+SCORE_HISTOGRAM_BINS = 10
+
+
+def field_mask(product: Dict) -> int:
+    """Bitmask of the QUALITY_FIELDS that are filled in."""
+    mask = 0
+    for field, bit in FIELD_BITS.items():
+        if product.get(field):
+            mask |= bit
+    return mask
+
+
+class ProductColumns:
+    """Compact columnar view of the scraped products for batch scoring and validation.
+
+    Each product is one row: its numeric ID in an `array('q')` and a one-byte
+    mask of filled-in QUALITY_FIELDS in a `bytearray`, about 9 bytes plus an
+    index entry per product. Scores and per-field missing flags are computed
+    for all rows at once with `bytes.translate` lookup tables, and the
+    validation summary is derived from the mask counts, so rebuilding it at
+    every checkpoint costs milliseconds. Adding an ID again replaces its row.
+    """
+
+    def __init__(self):
+        self.ids = array('q')
+        self.masks = bytearray()
+        self._rows: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def add(self, product: Dict) -> int:
+        """Record a product's field mask and return it."""
+        mask = field_mask(product)
+        product_id = int(product['id'])
+        row = self._rows.get(product_id)
+        if row is None:
+            self._rows[product_id] = len(self.masks)
+            self.ids.append(product_id)
+            self.masks.append(mask)
+        else:
+            self.masks[row] = mask
+        return mask
+
+    def extend(self, products: Iterable[Dict]):
+        for product in products:
+            self.add(product)
+
+    def scores(self) -> List[float]:
+        """Quality scores of every row, in row order."""
+        return [SCORE_TABLE[mask] for mask in self.masks]
+
+    def missing_ids(self, field: str) -> List[str]:
+        """IDs of the products without `field`, in the order they were added."""
+        bit = FIELD_BITS[field]
+        flags = bytes(self.masks).translate(bytes(0 if mask & bit else 1 for mask in range(256)))
+        ids = []
+        row = flags.find(1)
+        while row != -1:
+            ids.append(str(self.ids[row]))
+            row = flags.find(1, row + 1)
+        return ids
+
+    def summary(self) -> Dict:
+        """Product count, missing-field counts and a quality score histogram."""
+        mask_counts = [0] * 256
+        for mask, count in Counter(self.masks).items():
+            mask_counts[mask] = count
+        missing = {field: sum(count for mask, count in enumerate(mask_counts) if not mask & bit)
+                   for field, bit in FIELD_BITS.items()}
+        histogram = [0] * SCORE_HISTOGRAM_BINS
+        for mask, count in enumerate(mask_counts):
+            if count:
+                histogram[min(int(round(SCORE_TABLE[mask], 6) * SCORE_HISTOGRAM_BINS), SCORE_HISTOGRAM_BINS - 1)] += count
+        total = len(self.masks)
+        return {
+            'products': total,
+            'complete': mask_counts[ALL_FIELDS_MASK],
+            'missing_counts': missing,
+            'quality_score_histogram': {
+                f"{i / SCORE_HISTOGRAM_BINS:.1f}-{(i + 1) / SCORE_HISTOGRAM_BINS:.1f}": histogram[i]
+                for i in range(SCORE_HISTOGRAM_BINS)
+            },
+            'average_quality_score': round(sum(SCORE_TABLE[mask] * count for mask, count in enumerate(mask_counts)) / total, 4)
+            if total else 0.0,
+        }
+
+
+# Fields that change between crawls without the product changing.
+VOLATILE_FIELDS = frozenset(('dateAdded', 'fingerprint'))
+
+
+def product_fingerprint(product: Dict) -> str:
+    """Stable content hash of a product record, ignoring VOLATILE_FIELDS."""
+    stable = {key: value for key, value in product.items() if key not in VOLATILE_FIELDS}
+    encoded = json.dumps(stable, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+class SnapshotIndex:
+    """Product ID -> fingerprint of the last completed crawl.
+
+    Delta runs compare the new crawl against it and write a change feed of
+    added, modified and removed products, so downstream imports only touch
+    what changed. Without a snapshot file, the index is rebuilt once from the
+    previous nafdac_products.json.
+    """
+
+    ADDED = 'added'
+    MODIFIED = 'modified'
+    REMOVED = 'removed'
+
+    def __init__(self, path: str = 'nafdac_snapshot.json'):
+        self.path = path
+        self.fingerprints: Dict[str, str] = {}
+
+    def load(self, products_path: Optional[str] = None) -> bool:
+        """Load the index; returns False when there is no previous snapshot."""
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.fingerprints = json.load(f)['fingerprints']
+            return True
+        if products_path and os.path.exists(products_path):
+            with open(products_path, 'r', encoding='utf-8') as f:
+                self.fingerprints = {product['id']: product.get('fingerprint') or product_fingerprint(product)
+                                     for product in json.load(f)}
+            return True
+        return False
+
+    def save(self):
+        atomic_write_json(self.path, {'generated_at': datetime.now().isoformat(),
+                                      'fingerprints': self.fingerprints})
+
+    def write_changes(self, products: Iterable[Dict], path: str, keep_ids: Iterable[str] = (),
+                      keep_missing: bool = False) -> Dict[str, int]:
+        """Diff `products` against the index, write the JSONL change feed and advance the index.
+
+        IDs in `keep_ids` (e.g. products that failed this run) keep their
+        previous fingerprint instead of being reported as removed. With
+        `keep_missing` (the crawl did not see the whole catalogue) no product
+        is reported as removed; missing ones are counted as 'kept'.
+        """
+        previous = self.fingerprints
+        current: Dict[str, str] = {}
+        counts = {self.ADDED: 0, self.MODIFIED: 0, self.REMOVED: 0, 'unchanged': 0, 'kept': 0}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            for product in products:
+                fingerprint = product.get('fingerprint') or product_fingerprint(product)
+                current[product['id']] = fingerprint
+                old = previous.get(product['id'])
+                if old == fingerprint:
+                    counts['unchanged'] += 1
+                    continue
+                op = self.ADDED if old is None else self.MODIFIED
+                counts[op] += 1
+                out.write(json.dumps({'op': op, 'id': product['id'], 'fingerprint': fingerprint,
+                                      'record': product}, ensure_ascii=False) + '\n')
+            for product_id in keep_ids:
+                if product_id in previous and product_id not in current:
+                    current[product_id] = previous[product_id]
+                    counts['kept'] += 1
+            for product_id, fingerprint in previous.items():
+                if product_id in current:
+                    continue
+                if keep_missing:
+                    current[product_id] = fingerprint
+                    counts['kept'] += 1
+                else:
+                    counts[self.REMOVED] += 1
+                    out.write(json.dumps({'op': self.REMOVED, 'id': product_id, 'fingerprint': fingerprint}) + '\n')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, path)
+        self.fingerprints = current
+        return counts
+
+
+def iter_change_feed(path: str, ops: Iterable[str]) -> Iterator[Dict]:
+    """Yield change feed entries whose op is in `ops`."""
+    ops = set(ops)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            change = json.loads(line)
+            if change['op'] in ops:
+                yield change
+
+
+# --- Search index for app/search and app/marketplace ---
+
+SEARCH_FIELDS = ('brandName', 'genericName', 'manufacturer', 'nafdacNumber', 'strength')
+# Fields also indexed as one joined token, so "A4-1234" and "a41234", or "500 mg" and "500mg", match.
+JOINED_SEARCH_FIELDS = ('nafdacNumber', 'strength')
+SEARCH_TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def search_tokens(text: Optional[str]) -> List[str]:
+    """Lowercase ASCII alphanumeric tokens, with accents stripped (mirrored by lib/search-index.ts)."""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii').lower()
+    return SEARCH_TOKEN_PATTERN.findall(text)
+
+
+def _shard_char(term: str) -> str:
+    return term[0] if term and term[0] in '0123456789abcdefghijklmnopqrstuvwxyz' else '_'
+
+
+def _delta_encode(ids: Iterable[int]) -> List[int]:
+    encoded, previous = [], 0
+    for doc_id in sorted(ids):
+        encoded.append(doc_id - previous)
+        previous = doc_id
+    return encoded
+
+
+def _delta_decode(encoded: List[int]) -> List[int]:
+    return list(itertools.accumulate(encoded))
+
+
+class SearchIndex:
+    """Prebuilt product search index, as sharded JSON for lazy loading.
+
+    Layout of `directory`:
+
+        manifest.json      format version, fields, shard counts, document count
+        docs-NN.json       product ID -> [brandName, genericName, manufacturer,
+                           nafdacNumber, strength], sharded by ID modulo `doc_shards`
+        terms-C.json       {"terms": [sorted tokens], "postings": [delta-encoded IDs]}
+                           for tokens starting with C
+        trigrams-C.json    trigram -> sorted terms containing it, for trigrams starting with C
+
+    A query token matches every term it is a prefix of (a bisect over the
+    sorted terms of one shard). A token of three or more characters that is
+    no term's prefix matches the terms containing it instead, found through
+    the trigram shards. All query tokens must match; the longest is looked up
+    first, and once few candidates are left the rest are checked against the
+    candidates' own tokens. A reader only loads the shards a query touches.
+
+    `apply` updates the index in place from upserted and removed products and
+    rewrites only the shards those products touch, so a delta run with a few
+    changes costs a few small file writes.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory: str = 'search_index', doc_shards: int = 16):
+        self.directory = directory
+        self.doc_shards = doc_shards
+        self.documents = 0
+        self._term_cache: Dict[str, Tuple[List[str], List[List[int]]]] = {}
+        self._trigram_cache: Dict[str, Dict[str, List[str]]] = {}
+        self._doc_cache: Dict[str, Dict[str, List[str]]] = {}
+        manifest = self._read('manifest.json')
+        if manifest and manifest.get('version') == self.VERSION:
+            self.doc_shards = manifest['doc_shards']
+            self.documents = manifest['documents']
+
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, 'manifest.json'))
+
+    def _read(self, name: str):
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write(self, name: str, data):
+        atomic_write_json(os.path.join(self.directory, name), data, ensure_ascii=False, separators=(',', ':'))
+
+    def _doc_shard_name(self, product_id: str) -> str:
+        return f"docs-{int(product_id) % self.doc_shards:02d}.json"
+
+    @staticmethod
+    def document_terms(document: List[str]) -> set:
+        """Index terms of a document's SEARCH_FIELDS values."""
+        tokens = set()
+        for field, value in zip(SEARCH_FIELDS, document):
+            field_tokens = search_tokens(value)
+            tokens.update(field_tokens)
+            if field in JOINED_SEARCH_FIELDS and len(field_tokens) > 1:
+                tokens.add(''.join(field_tokens))
+        return tokens
+
+    @staticmethod
+    def trigrams(term: str) -> set:
+        return {term[i:i + 3] for i in range(len(term) - 2)}
+
+    def rebuild(self, products: Iterable[Dict]) -> Dict[str, int]:
+        """Replace the index with one built from `products`."""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if re.fullmatch(r'(manifest|docs-\d+|terms-\w|trigrams-\w)\.json', name):
+                os.remove(os.path.join(self.directory, name))
+        self.documents = 0
+        return self.apply(products)
+
+    def apply(self, upserts: Iterable[Dict], removed_ids: Iterable[str] = ()) -> Dict[str, int]:
+        """Index upserted products and drop removed ones, rewriting only the touched shards."""
+        os.makedirs(self.directory, exist_ok=True)
+        docs: Dict[str, Dict[str, List[str]]] = {}
+        changed_docs = set()
+        changed_ids = set()
+        # shard -> term -> [IDs to add, IDs to remove]
+        term_changes: Dict[str, Dict[str, Tuple[set, set]]] = {}
+        # shard -> trigram -> [terms new to the index, terms gone from it]
+        trigram_changes: Dict[str, Dict[str, Tuple[set, set]]] = {}
+
+        def doc_shard(name):
+            if name not in docs:
+                docs[name] = self._read(name) or {}
+            return docs[name]
+
+        def record(changes, keys, value, added):
+            for key in keys:
+                entry = changes.setdefault(_shard_char(key), {}).setdefault(key, (set(), set()))
+                entry[0 if added else 1].add(value)
+
+        def replace(product_id, new_document):
+            name = self._doc_shard_name(product_id)
+            shard = doc_shard(name)
+            old_document = shard.get(product_id)
+            if old_document == new_document:
+                return
+            doc_id = int(product_id)
+            old_terms = self.document_terms(old_document) if old_document else set()
+            new_terms = self.document_terms(new_document) if new_document else set()
+            record(term_changes, new_terms - old_terms, doc_id, True)
+            record(term_changes, old_terms - new_terms, doc_id, False)
+            if new_document:
+                shard[product_id] = new_document
+            else:
+                del shard[product_id]
+            self.documents += (new_document is not None) - (old_document is not None)
+            changed_docs.add(name)
+            changed_ids.add(product_id)
+
+        for product in upserts:
+            replace(str(product['id']), [product.get(field) or '' for field in SEARCH_FIELDS])
+        for product_id in removed_ids:
+            replace(str(product_id), None)
+
+        for char, changes in term_changes.items():
+            name = f"terms-{char}.json"
+            shard = self._read(name) or {'terms': [], 'postings': []}
+            postings = {term: set(_delta_decode(ids)) for term, ids in zip(shard['terms'], shard['postings'])}
+            for term, (added, removed) in changes.items():
+                ids = (postings.get(term, set()) - removed) | added
+                if ids and term not in postings:
+                    record(trigram_changes, self.trigrams(term), term, True)
+                elif not ids and term in postings:
+                    record(trigram_changes, self.trigrams(term), term, False)
+                if ids:
+                    postings[term] = ids
+                else:
+                    postings.pop(term, None)
+            terms = sorted(postings)
+            self._write(name, {'terms': terms, 'postings': [_delta_encode(postings[term]) for term in terms]})
+        for char, changes in trigram_changes.items():
+            name = f"trigrams-{char}.json"
+            shard = {trigram: set(terms) for trigram, terms in (self._read(name) or {}).items()}
+            for trigram, (added, removed) in changes.items():
+                terms = (shard.get(trigram, set()) - removed) | added
+                if terms:
+                    shard[trigram] = terms
+                else:
+                    shard.pop(trigram, None)
+            self._write(name, {trigram: sorted(terms) for trigram, terms in sorted(shard.items())})
+        for name in changed_docs:
+            self._write(name, docs[name])
+        self._write('manifest.json', {
+            'version': self.VERSION,
+            'generated_at': datetime.now().isoformat(),
+            'fields': list(SEARCH_FIELDS),
+            'joined_fields': list(JOINED_SEARCH_FIELDS),
+            'doc_shards': self.doc_shards,
+            'documents': self.documents,
+        })
+        self._term_cache.clear()
+        self._trigram_cache.clear()
+        self._doc_cache.clear()
+        return {'documents': self.documents, 'changed_documents': len(changed_ids),
+                'term_shards': len(term_changes), 'trigram_shards': len(trigram_changes), 'doc_shards': len(changed_docs)}
+
+    # Lookups (the Next.js side reads the same files through lib/search-index.ts).
+
+    VERIFY_LIMIT = 256
+
+    def _terms(self, char: str) -> Tuple[List[str], List[List[int]]]:
+        if char not in self._term_cache:
+            shard = self._read(f"terms-{char}.json") or {'terms': [], 'postings': []}
+            self._term_cache[char] = (shard['terms'], [_delta_decode(ids) for ids in shard['postings']])
+        return self._term_cache[char]
+
+    def _trigram_terms(self, trigram: str) -> List[str]:
+        char = _shard_char(trigram)
+        if char not in self._trigram_cache:
+            self._trigram_cache[char] = self._read(f"trigrams-{char}.json") or {}
+        return self._trigram_cache[char].get(trigram, [])
+
+    def _prefix_range(self, token: str) -> Tuple[List[str], List[List[int]], int, int]:
+        terms, postings = self._terms(_shard_char(token))
+        lo = bisect.bisect_left(terms, token)
+        return terms, postings, lo, bisect.bisect_left(terms, token + '\x7f', lo)
+
+    def _postings(self, term: str) -> List[int]:
+        terms, postings, lo, hi = self._prefix_range(term)
+        return postings[lo] if lo < hi and terms[lo] == term else []
+
+    def _raw_document(self, product_id: str) -> Optional[List[str]]:
+        name = self._doc_shard_name(product_id)
+        if name not in self._doc_cache:
+            self._doc_cache[name] = self._read(name) or {}
+        return self._doc_cache[name].get(product_id)
+
+    def document(self, product_id: str) -> Optional[Dict[str, str]]:
+        document = self._raw_document(product_id)
+        return dict(zip(SEARCH_FIELDS, document), id=product_id) if document else None
+
+    def _match(self, token: str) -> Tuple[set, set]:
+        """(IDs matching `token`, IDs having it as a whole term)."""
+        terms, postings, lo, hi = self._prefix_range(token)
+        matched, exact = set(), set()
+        if lo < hi:
+            for i in range(lo, hi):
+                matched.update(postings[i])
+            if terms[lo] == token:
+                exact = set(postings[lo])
+            return matched, exact
+        if len(token) < 3:
+            return matched, exact
+        candidates = None
+        for trigram in self.trigrams(token):
+            found = set(self._trigram_terms(trigram))
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                return matched, exact
+        for term in candidates:
+            if token in term:
+                matched.update(self._postings(term))
+        return matched, exact
+
+    def _filter(self, results: set, token: str) -> Tuple[set, set]:
+        """`_match` restricted to `results`, checked against each candidate's own terms."""
+        _, _, lo, hi = self._prefix_range(token)
+        if lo == hi and len(token) < 3:
+            return set(), set()
+        matched, exact = set(), set()
+        for doc_id in results:
+            terms = self.document_terms(self._raw_document(str(doc_id)) or [])
+            if lo < hi:
+                if any(term.startswith(token) for term in terms):
+                    matched.add(doc_id)
+                    if token in terms:
+                        exact.add(doc_id)
+            elif any(token in term for term in terms):
+                matched.add(doc_id)
+        return matched, exact
+
+    def search(self, query: str, limit: int = 20) -> List[Dict[str, str]]:
+        """Products matching every query token; whole-term matches rank first."""
+        results = None
+        exact_hits = Counter()
+        for token in sorted(dict.fromkeys(search_tokens(query)), key=len, reverse=True):
+            if results is not None and len(results) <= self.VERIFY_LIMIT:
+                matched, exact = self._filter(results, token)
+            else:
+                matched, exact = self._match(token)
+            results = matched if results is None else results & matched
+            if not results:
+                return []
+            exact_hits.update(exact)
+        if not results:
+            return []
+        ranked = sorted(results, key=lambda doc_id: (-exact_hits[doc_id], doc_id))[:limit]
+        return [self.document(str(doc_id)) for doc_id in ranked]
+
+
+# --- Bulk export for supabase/migrations/20240320000000_initial_schema.sql ---
+
+try:
+    import psycopg2
+except ImportError:  # optional: only needed to load bulk exports into Postgres
+    psycopg2 = None
+
+GENERIC_DRUG_COLUMNS = ('id', 'name', 'category', 'description', 'indication')
+BRANDED_PRODUCT_COLUMNS = ('id', 'generic_id', 'brand_name', 'manufacturer', 'strength', 'dosage_form', 'pack_size',
+                           'verified', 'rating', 'image', 'bioequivalence', 'nafdac_number', 'type',
+                           'date_added', 'country_of_origin')
+# Columns kept from the existing row when a branded product is re-imported.
+BRANDED_PRODUCT_INSERT_ONLY = frozenset(('id', 'date_added'))
+
+GENERIC_DRUGS_CSV = 'generic_drugs.csv'
+BRANDED_PRODUCTS_CSV = 'branded_products.csv'
+REMOVED_PRODUCTS_CSV = 'branded_products_removed.csv'
+# Columns whose empty CSV value is loaded as NULL.
+NULLABLE_COLUMNS = {BRANDED_PRODUCTS_CSV: ('bioequivalence',)}
+
+
+def generic_drug_id(generic_name: str) -> str:
+    """Same ID as scripts/import-nafdac-json.ts derives from the generic name."""
+    return re.sub(r'\s+', '_', generic_name).lower()
+
+
+def branded_product_row(product: Dict) -> Tuple:
+    """A branded_products row in BRANDED_PRODUCT_COLUMNS order."""
+    bioequivalence = product.get('bioequivalence')
+    return (
+        product['id'],
+        generic_drug_id(product.get('genericName') or 'Unknown'),
+        product.get('brandName', ''),
+        product.get('manufacturer', ''),
+        product.get('strength', ''),
+        product.get('dosageForm', ''),
+        product.get('packSize', ''),
+        't' if product.get('verified') else 'f',
+        product.get('rating', 0),
+        product.get('image', ''),
+        bioequivalence if isinstance(bioequivalence, (int, float)) and not isinstance(bioequivalence, bool) else None,
+        product.get('nafdacNumber', ''),
+        'otc' if product.get('type') == 'otc' else 'prescription',
+        product.get('dateAdded') or datetime.now().strftime('%Y-%m-%d'),
+        product.get('countryOfOrigin', ''),
+    )
+
+
+def _csv_writer(f):
+    # Every string is quoted, so COPY reads '' as an empty string; NULLABLE_COLUMNS are loaded with FORCE_NULL.
+    return csv.writer(f, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n')
+
+
+def write_bulk_export(products: Iterable[Dict], directory: str, removed_ids: Iterable[str] = ()) -> Dict[str, int]:
+    """Write COPY-ready CSV files (with headers) for generic_drugs and branded_products.
+
+    `removed_ids` go to a separate file so a delta load can delete them.
+    Returns the row count per file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    generics: Dict[str, str] = {}
+    counts = {GENERIC_DRUGS_CSV: 0, BRANDED_PRODUCTS_CSV: 0, REMOVED_PRODUCTS_CSV: 0}
+    brands_path = os.path.join(directory, BRANDED_PRODUCTS_CSV)
+    with open(f"{brands_path}.tmp", 'w', encoding='utf-8', newline='') as f:
+        writer = _csv_writer(f)
+        writer.writerow(BRANDED_PRODUCT_COLUMNS)
+        for product in products:
+            row = branded_product_row(product)
+            generics.setdefault(row[1], product.get('genericName') or 'Unknown')
+            writer.writerow(row)
+            counts[BRANDED_PRODUCTS_CSV] += 1
+    generics_path = os.path.join(directory, GENERIC_DRUGS_CSV)
+    with open(f"{generics_path}.tmp", 'w', encoding='utf-8', newline='') as f:
+        writer = _csv_writer(f)
+        writer.writerow(GENERIC_DRUG_COLUMNS)
+        for generic_id, name in generics.items():
+            # category, description and indication are curated later in the database.
+            writer.writerow((generic_id, name, '', '', ''))
+            counts[GENERIC_DRUGS_CSV] += 1
+    removed_path = os.path.join(directory, REMOVED_PRODUCTS_CSV)
+    with open(f"{removed_path}.tmp", 'w', encoding='utf-8', newline='') as f:
+        writer = _csv_writer(f)
+        writer.writerow(('id',))
+        for product_id in removed_ids:
+            writer.writerow((product_id,))
+            counts[REMOVED_PRODUCTS_CSV] += 1
+    for path in (brands_path, generics_path, removed_path):
+        os.replace(f"{path}.tmp", path)
+    return counts
+
+
+def load_bulk_export(directory: str, dsn: str) -> Dict[str, int]:
+    """Apply a bulk export to Postgres in a single transaction.
+
+    Each file is streamed with COPY into a temporary staging table and merged
+    with one set-based INSERT ... ON CONFLICT per table: generic drugs that
+    already exist are left alone (keeping curated categories), branded
+    products are updated in place, and removed products are deleted.
+    """
+    if psycopg2 is None:
+        raise RuntimeError("psycopg2 is required to load bulk exports (pip install psycopg2-binary)")
+    brand_columns = ', '.join(BRANDED_PRODUCT_COLUMNS)
+    brand_updates = ', '.join(f"{column} = excluded.{column}" for column in BRANDED_PRODUCT_COLUMNS
+                              if column not in BRANDED_PRODUCT_INSERT_ONLY)
+    generic_columns = ', '.join(GENERIC_DRUG_COLUMNS)
+    loaded = {}
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("SET LOCAL synchronous_commit = off")
+            cur.execute(f"""
+                CREATE TEMP TABLE generic_drugs_staging ON COMMIT DROP AS
+                    SELECT {generic_columns} FROM generic_drugs WITH NO DATA;
+                CREATE TEMP TABLE branded_products_staging ON COMMIT DROP AS
+                    SELECT {brand_columns} FROM branded_products WITH NO DATA;
+                CREATE TEMP TABLE branded_products_removed ON COMMIT DROP AS
+                    SELECT id FROM branded_products WITH NO DATA;
+            """)
+            for table, name in (('generic_drugs_staging', GENERIC_DRUGS_CSV),
+                                ('branded_products_staging', BRANDED_PRODUCTS_CSV),
+                                ('branded_products_removed', REMOVED_PRODUCTS_CSV)):
+                path = os.path.join(directory, name)
+                if not os.path.exists(path):
+                    continue
+                force_null = ', '.join(NULLABLE_COLUMNS.get(name, ()))
+                options = f", FORCE_NULL ({force_null})" if force_null else ''
+                with open(path, 'r', encoding='utf-8') as f:
+                    cur.copy_expert(f"COPY {table} FROM STDIN WITH (FORMAT csv, HEADER true{options})", f)
+
+            cur.execute(f"""
+                INSERT INTO generic_drugs ({generic_columns})
+                SELECT {generic_columns} FROM generic_drugs_staging
+                ON CONFLICT (id) DO NOTHING
+            """)
+            loaded['generic_drugs'] = cur.rowcount
+            cur.execute(f"""
+                INSERT INTO branded_products ({brand_columns})
+                SELECT {brand_columns} FROM branded_products_staging
+                ON CONFLICT (id) DO UPDATE SET {brand_updates}
+            """)
+            loaded['branded_products'] = cur.rowcount
+            cur.execute("DELETE FROM branded_products WHERE id IN (SELECT id FROM branded_products_removed)")
+            loaded['branded_products_deleted'] = cur.rowcount
+    finally:
+        conn.close()
+    return loaded
+
+
+class CheckpointStore:
+    """Crawl state in SQLite (WAL mode), one row per ingredient or product.
+
+    Product rows are keyed by the brand ID from the ingredient listing, which is
+    also the product details ID. Every state change is its own transaction, so
+    a crash loses at most the item in flight, and membership checks hit the
+    primary key instead of scanning a list. `seq` records the order items were
+    first seen, which keeps exports in crawl order.
+    """
+
+    INGREDIENT = 'ingredient'
+    PRODUCT = 'product'
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path: str = 'scraping_checkpoint.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                kind TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                seq INTEGER NOT NULL,
+                parent_id TEXT,
+                payload TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (kind, item_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_items_state ON items (kind, state, seq);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM items").fetchone()[0]
+
+    def has_state(self) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM items LIMIT 1").fetchone() is not None
+
+    def is_done(self, kind: str, item_id: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM items WHERE kind = ? AND item_id = ?", (kind, item_id)).fetchone()
+        return row is not None and row[0] == self.DONE
+
+    def mark(self, kind: str, item_id: str, state: str, parent_id: Optional[str] = None,
+             payload: Optional[Dict] = None):
+        """Record an item's state; DONE and FAILED count as one attempt each."""
+        attempted = 1 if state in (self.DONE, self.FAILED) else 0
+        with self._lock:
+            self._seq += 1
+            self._conn.execute("""
+                INSERT INTO items (kind, item_id, state, attempts, seq, parent_id, payload, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, item_id) DO UPDATE SET
+                    state = excluded.state,
+                    attempts = attempts + excluded.attempts,
+                    parent_id = COALESCE(excluded.parent_id, parent_id),
+                    payload = COALESCE(excluded.payload, payload),
+                    updated_at = excluded.updated_at
+            """, (kind, item_id, state, attempted, self._seq, parent_id,
+                  json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+                  datetime.now().isoformat()))
+
+    def count(self, kind: str, state: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM items WHERE kind = ? AND state = ?", (kind, state)).fetchone()[0]
+
+    def items(self, kind: str, state: str, batch_size: int = 1000) -> Iterator[Tuple[str, Optional[str], Optional[Dict], int]]:
+        """Yield (item_id, parent_id, payload, attempts) in crawl order, a batch at a time."""
+        last_seq = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute("""
+                    SELECT seq, item_id, parent_id, payload, attempts FROM items
+                    WHERE kind = ? AND state = ? AND seq > ? ORDER BY seq LIMIT ?
+                """, (kind, state, last_seq, batch_size)).fetchall()
+            if not rows:
+                return
+            for seq, item_id, parent_id, payload, attempts in rows:
+                yield item_id, parent_id, json.loads(payload) if payload else None, attempts
+            last_seq = rows[-1][0]
+
+    def payload(self, kind: str, item_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload FROM items WHERE kind = ? AND item_id = ?", (kind, item_id)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def ids(self, kind: str, state: str) -> Iterator[str]:
+        for item_id, _, _, _ in self.items(kind, state):
+            yield item_id
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value)))
+
+    def reset(self):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM items")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.execute("COMMIT")
+            self._seq = 0
+
+    def import_progress(self, progress: Dict):
+        """Load a legacy scraping_progress.json structure in one transaction."""
+        rows = [(self.INGREDIENT, item_id, self.DONE) for item_id in progress.get('processed_ingredients', [])]
+        rows += [(self.PRODUCT, item_id, self.DONE) for item_id in progress.get('processed_brands', [])]
+        rows += [(self.PRODUCT, item_id, self.FAILED) for item_id in progress.get('failed_scrapes', [])]
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for kind, item_id, state in rows:
+                self._seq += 1
+                # A product that failed and later succeeded keeps its DONE state.
+                self._conn.execute("""
+                    INSERT INTO items (kind, item_id, state, attempts, seq, updated_at)
+                    VALUES (?, ?, ?, 1, ?, ?) ON CONFLICT (kind, item_id) DO NOTHING
+                """, (kind, item_id, state, self._seq, now))
+            self._conn.execute("COMMIT")
+
+    def export_progress(self, progress: Dict, path: str):
+        """Write the legacy scraping_progress.json format."""
+        exported = dict(progress)
+        exported['processed_ingredients'] = list(self.ids(self.INGREDIENT, self.DONE))
+        exported['processed_brands'] = list(self.ids(self.PRODUCT, self.DONE))
+        exported['failed_scrapes'] = list(self.ids(self.PRODUCT, self.FAILED))
+        atomic_write_json(path, exported, indent=2)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class WorkQueue:
+    """Shared SQLite work queue for sharded crawls.
+
+    The coordinator enqueues ingredients; a worker that finishes an ingredient
+    enqueues its brands as product tasks in the same transaction. Workers
+    lease pending tasks for `lease_seconds`; a lease that expires (the worker
+    died or stalled) makes the task available again, until it has been leased
+    `max_attempts` times and is marked failed. Tasks are ordered by
+    (seq, sub_seq) = (ingredient order, brand position), which is also the
+    order results are merged in, whatever worker finished first.
+
+    Each coordinator run starts a new generation in `meta`, so workers can tell
+    a crawl in progress from one a reused queue file finished earlier.
+
+    Workers on other machines need the queue on a filesystem with working
+    POSIX locks, as SQLite requires.
+    """
+
+    INGREDIENT = CheckpointStore.INGREDIENT
+    PRODUCT = CheckpointStore.PRODUCT
+
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path: str = 'work_queue.db', lease_seconds: float = 120.0, max_attempts: int = 3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                kind TEXT NOT NULL,
+                item_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                sub_seq INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL,
+                owner TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                parent_id TEXT,
+                payload TEXT,
+                result TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (kind, item_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks (state, seq, sub_seq);
+            CREATE INDEX IF NOT EXISTS idx_tasks_order ON tasks (kind, seq, sub_seq);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+
+    def _transaction(self, sql_calls: Callable[[sqlite3.Connection], object]):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can't lease the same rows.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = sql_calls(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return value
+
+    def next_seq(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM tasks").fetchone()[0]
+
+    def add(self, kind: str, item_id: str, seq: int, payload: Optional[Dict] = None):
+        """Enqueue a task unless it is already queued."""
+        def insert(conn):
+            conn.execute("""
+                INSERT INTO tasks (kind, item_id, seq, state, payload, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, item_id) DO NOTHING
+            """, (kind, item_id, seq, self.PENDING, json.dumps(payload, ensure_ascii=False), time.time()))
+        self._transaction(insert)
+
+    def lease(self, owner: str, limit: int) -> List[Tuple[str, str, Optional[str], Optional[Dict]]]:
+        """Lease up to `limit` tasks as (kind, item_id, parent_id, payload), reclaiming expired leases."""
+        def take(conn):
+            now = time.time()
+            conn.execute("""
+                UPDATE tasks SET state = ?, owner = NULL, updated_at = ?
+                WHERE state = ? AND lease_expires < ? AND attempts >= ?
+            """, (self.FAILED, now, self.LEASED, now, self.max_attempts))
+            rows = conn.execute("""
+                SELECT kind, item_id, parent_id, payload FROM tasks
+                WHERE state = ? OR (state = ? AND lease_expires < ?)
+                ORDER BY seq, sub_seq LIMIT ?
+            """, (self.PENDING, self.LEASED, now, limit)).fetchall()
+            conn.executemany("""
+                UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ?
+                WHERE kind = ? AND item_id = ?
+            """, [(self.LEASED, owner, now + self.lease_seconds, now, kind, item_id) for kind, item_id, _, _ in rows])
+            return [(kind, item_id, parent_id, json.loads(payload) if payload else None)
+                    for kind, item_id, parent_id, payload in rows]
+        return self._transaction(take)
+
+    def complete(self, kind: str, item_id: str, owner: str, state: str, result: Optional[Dict] = None,
+                 children: Iterable[Tuple[str, str, Dict]] = ()):
+        """Report a leased task as DONE or FAILED and enqueue its (kind, item_id, payload) children.
+
+        Results from a lease that was meanwhile reclaimed by another worker are
+        dropped. A child already queued under a later task moves to this one,
+        so a product listed under several ingredients ends up under the first.
+        """
+        def report(conn):
+            now = time.time()
+            row = conn.execute("SELECT seq FROM tasks WHERE kind = ? AND item_id = ? AND owner = ? AND state = ?",
+                               (kind, item_id, owner, self.LEASED)).fetchone()
+            if row is None:
+                return False
+            conn.execute("""
+                UPDATE tasks SET state = ?, result = ?, lease_expires = NULL, updated_at = ? WHERE kind = ? AND item_id = ?
+            """, (state, json.dumps(result, ensure_ascii=False) if result is not None else None, now, kind, item_id))
+            conn.executemany("""
+                INSERT INTO tasks (kind, item_id, seq, sub_seq, state, parent_id, payload, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (kind, item_id) DO UPDATE SET
+                    seq = excluded.seq, sub_seq = excluded.sub_seq,
+                    parent_id = excluded.parent_id, payload = excluded.payload
+                WHERE (excluded.seq, excluded.sub_seq) < (tasks.seq, tasks.sub_seq)
+            """, [(child_kind, child_id, row[0], position, self.PENDING, item_id,
+                   json.dumps(payload, ensure_ascii=False), now)
+                  for position, (child_kind, child_id, payload) in enumerate(children)])
+            return True
+        return self._transaction(report)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def outstanding(self) -> int:
+        counts = self.counts()
+        return counts.get(self.PENDING, 0) + counts.get(self.LEASED, 0)
+
+    def finished(self) -> bool:
+        """True once discovery is complete and every task is done or failed."""
+        return bool(self.get_meta('discovery_done', False)) and self.outstanding() == 0
+
+    def start_generation(self) -> int:
+        """Begin a coordinator run: bump the generation and reopen discovery in one transaction."""
+        def bump(conn):
+            row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            generation = (json.loads(row[0]) if row else 0) + 1
+            conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                [('generation', json.dumps(generation)), ('discovery_done', json.dumps(False))])
+            return generation
+        return self._transaction(bump)
+
+    def generation(self) -> int:
+        return self.get_meta('generation', 0)
+
+    def results(self, kind: str, batch_size: int = 1000) -> Iterator[Tuple[str, str, Optional[str], Optional[Dict], Optional[Dict]]]:
+        """Yield (item_id, state, parent_id, payload, result) in merge order, a batch at a time."""
+        last = (0, -1)
+        while True:
+            with self._lock:
+                rows = self._conn.execute("""
+                    SELECT seq, sub_seq, item_id, state, parent_id, payload, result FROM tasks
+                    WHERE kind = ? AND (seq, sub_seq) > (?, ?) ORDER BY seq, sub_seq LIMIT ?
+                """, (kind, last[0], last[1], batch_size)).fetchall()
+            if not rows:
+                return
+            for _, _, item_id, state, parent_id, payload, result in rows:
+                yield (item_id, state, parent_id, json.loads(payload) if payload else None,
+                       json.loads(result) if result else None)
+            last = (rows[-1][0], rows[-1][1])
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, json.dumps(value)))
+
+    def reset(self):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM tasks")
+            self._conn.execute("DELETE FROM meta")
+            self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class ScraperMetrics:
+    """Thread-safe counters, gauges and histograms.
+
+    Exported in the Prometheus text format (`to_prometheus`) or as JSON
+    (`to_dict`). Collectors registered with `add_collector` are called before
+    each export to refresh gauges that are cheaper to read on demand.
+    """
+
+    def __init__(self, namespace: str = 'nafdac_scraper'):
+        self.namespace = namespace
+        self.started = time.time()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._gauges: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._collectors: List[Callable[['ScraperMetrics'], None]] = []
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            bounds = self._buckets.setdefault(name, buckets)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # [count, sum, max, per-bucket counts]
+                histogram = self._histograms[key] = [0, 0.0, 0.0, [0] * len(bounds)]
+            histogram[0] += 1
+            histogram[1] += value
+            histogram[2] = max(histogram[2], value)
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    histogram[3][i] += 1
+                    break
+
+    def add_collector(self, collector: Callable[['ScraperMetrics'], None]):
+        self._collectors.append(collector)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def _collect(self):
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                logger.debug("Metrics collector failed: %s", e)
+
+    @staticmethod
+    def _format_labels(labels: Tuple, extra: Optional[Tuple] = None) -> str:
+        pairs = list(labels) + list(extra or ())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+    def to_prometheus(self) -> str:
+        self._collect()
+        lines = []
+        with self._lock:
+            typed = set()
+            for kind, series in (('counter', self._counters), ('gauge', self._gauges)):
+                for (name, labels), value in sorted(series.items()):
+                    full_name = f"{self.namespace}_{name}"
+                    if full_name not in typed:
+                        lines.append(f"# TYPE {full_name} {kind}")
+                        typed.add(full_name)
+                    lines.append(f"{full_name}{self._format_labels(labels)} {value:g}")
+            for (name, labels), (count, total, _, bucket_counts) in sorted(self._histograms.items()):
+                full_name = f"{self.namespace}_{name}"
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} histogram")
+                    typed.add(full_name)
+                cumulative = 0
+                for bound, bucket_count in zip(self._buckets[name], bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f"{full_name}_bucket{self._format_labels(labels, (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{full_name}_bucket{self._format_labels(labels, (('le', '+Inf'),))} {count}")
+                lines.append(f"{full_name}_sum{self._format_labels(labels)} {total:g}")
+                lines.append(f"{full_name}_count{self._format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def to_dict(self) -> Dict:
+        self._collect()
+
+        def key_name(name, labels):
+            return name + ''.join(f"[{k}={v}]" for k, v in labels)
+
+        with self._lock:
+            return {
+                'timestamp': datetime.now().isoformat(),
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'counters': {key_name(n, l): v for (n, l), v in sorted(self._counters.items())},
+                'gauges': {key_name(n, l): v for (n, l), v in sorted(self._gauges.items())},
+                'histograms': {
+                    key_name(n, l): {'count': c, 'sum': round(s, 6), 'avg': round(s / c, 6) if c else 0.0, 'max': round(m, 6)}
+                    for (n, l), (c, s, m, _) in sorted(self._histograms.items())
+                },
+            }
+
+
+class MetricsExporter:
+    """Writes metrics to a JSON file (and optionally a Prometheus textfile)
+    every `interval` seconds, and optionally serves them over HTTP at
+    /metrics (Prometheus text) and /metrics.json."""
+
+    def __init__(self, metrics: ScraperMetrics, json_path: Optional[str] = 'scraper_metrics.json',
+                 prometheus_path: Optional[str] = None, interval: float = 15.0, port: Optional[int] = None):
+        self.metrics = metrics
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.port = port
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._server = None
+
+    def start(self):
+        if self.port is not None:
+            self._server = ThreadingHTTPServer(('0.0.0.0', self.port), self._handler())
+            self._server.daemon_threads = True
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+            logger.info("Serving metrics on http://0.0.0.0:%d/metrics", self._server.server_port)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = metrics.to_prometheus().encode('utf-8'), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(metrics.to_dict()).encode('utf-8'), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        if self.json_path:
+            atomic_write_json(self.json_path, self.metrics.to_dict(), indent=2)
+        if self.prometheus_path:
+            tmp_path = f"{self.prometheus_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.metrics.to_prometheus())
+            os.replace(tmp_path, self.prometheus_path)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.write()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+# Connection-level timings: fetch() points the calling thread at its metrics
+# before sending, and the instrumented connection classes record into them.
+_request_context = threading.local()
+
+
+class _TimedConnectionMixin:
+    """Times DNS resolution and the TCP connect of every new connection."""
+
+    def _new_conn(self):
+        metrics = getattr(_request_context, 'metrics', None)
+        if metrics is None:
+            return super()._new_conn()
+        dns_host = self._dns_host
+        started = time.perf_counter()
+        try:
+            addresses = list(dict.fromkeys(
+                info[4][0] for info in socket.getaddrinfo(dns_host, self.port, 0, socket.SOCK_STREAM)))
+        except OSError:
+            return super()._new_conn()  # let urllib3 raise its usual error
+        resolved = time.perf_counter()
+        metrics.observe('dns_seconds', resolved - started)
+        try:
+            for i, address in enumerate(addresses):
+                # Connect to the address resolved above instead of resolving again.
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = dns_host
+        self._connected_at = time.perf_counter()
+        metrics.observe('connect_seconds', self._connected_at - resolved)
+        return sock
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        self._connected_at = None
+        super().connect()
+        metrics = getattr(_request_context, 'metrics', None)
+        if metrics is not None and self._connected_at is not None:
+            metrics.observe('tls_seconds', time.perf_counter() - self._connected_at)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools time DNS, TCP connect and TLS setup."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+class FetchResult:
+    """A fetched page. `unchanged` is set when the response cache confirmed the
+    page is identical to the cached copy (304, or the same content hash);
+    `cached_record` then holds the product parsed from that copy, if any."""
+
+    __slots__ = ('url', 'text', 'unchanged', 'cached_record')
+
+    def __init__(self, url: str, text: str, unchanged: bool = False, cached_record: Optional[Dict] = None):
+        self.url = url
+        self.text = text
+        self.unchanged = unchanged
+        self.cached_record = cached_record
+
+
+class ResponseCache:
+    """Persistent HTTP response cache for conditional re-crawls.
+
+    Stores the compressed body, ETag/Last-Modified validators and a content hash
+    per URL, plus the product record parsed from that body and the version of
+    the parser that produced it. A parsed record is only reused while it
+    matches `parser_version`. Entries older than `max_age` seconds are dropped,
+    and least recently used entries are evicted once the stored bodies exceed
+    `max_bytes`.
+    """
+
+    def __init__(self, path: str = 'http_cache.db', max_bytes: int = 512 * 1024 * 1024,
+                 max_age: float = 30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        # Set by NAFDACScraper to its parser's version.
+        self.parser_version: Optional[str] = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                parsed TEXT,
+                parser_version TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at);
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(responses)")}
+        if 'parser_version' not in columns:
+            self._conn.execute("ALTER TABLE responses ADD COLUMN parser_version TEXT")
+
+    def _parsed(self, parsed: Optional[str], version: Optional[str]) -> Optional[Dict]:
+        """A cached parsed record, unless a different parser version produced it."""
+        if not parsed or version != self.parser_version:
+            return None
+        return json.loads(parsed)
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Conditional request headers for `url`, or {} if it isn't cached."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified FROM responses WHERE url = ? AND fetched_at > ?",
+                (url, time.time() - self.max_age)).fetchone()
+        if not row:
+            return {}
+        headers = {}
+        if row[0]:
+            headers['If-None-Match'] = row[0]
+        if row[1]:
+            headers['If-Modified-Since'] = row[1]
+        return headers
+
+    def revalidated(self, url: str) -> Optional[FetchResult]:
+        """Handle a 304: refresh the entry and return the cached page."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT body, parsed, parser_version FROM responses WHERE url = ?",
+                                     (url,)).fetchone()
+            if not row:
+                return None
+            self._conn.execute("UPDATE responses SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, url))
+            self.hits += 1
+        return FetchResult(url, zlib.decompress(row[0]).decode('utf-8'), True, self._parsed(row[1], row[2]))
+
+    def store(self, url: str, text: str, etag: Optional[str], last_modified: Optional[str]) -> FetchResult:
+        """Store a 200 response; a body identical to the cached one counts as unchanged."""
+        content_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash, parsed, parser_version FROM responses WHERE url = ?",
+                                     (url,)).fetchone()
+            if row and row[0] == content_hash:
+                self._conn.execute("""
+                    UPDATE responses SET etag = ?, last_modified = ?, fetched_at = ?, accessed_at = ? WHERE url = ?
+                """, (etag, last_modified, now, now, url))
+                self.hits += 1
+                return FetchResult(url, text, True, self._parsed(row[1], row[2]))
+            body = zlib.compress(text.encode('utf-8'))
+            self._conn.execute("""
+                INSERT INTO responses (url, etag, last_modified, content_hash, body, size, parsed, fetched_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    etag = excluded.etag, last_modified = excluded.last_modified,
+                    content_hash = excluded.content_hash, body = excluded.body, size = excluded.size,
+                    parsed = NULL, fetched_at = excluded.fetched_at, accessed_at = excluded.accessed_at
+            """, (url, etag, last_modified, content_hash, body, len(body), now, now))
+            self.misses += 1
+        return FetchResult(url, text)
+
+    def store_parsed(self, url: str, record: Dict):
+        with self._lock:
+            self._conn.execute("UPDATE responses SET parsed = ?, parser_version = ? WHERE url = ?",
+                               (json.dumps(record, ensure_ascii=False), self.parser_version, url))
+
+    def clear_parsed(self, pattern: str = '%') -> int:
+        """Forget the parsed records of URLs matching a SQL LIKE pattern; their bodies are kept."""
+        with self._lock:
+            return self._conn.execute("UPDATE responses SET parsed = NULL, parser_version = NULL "
+                                      "WHERE url LIKE ? AND parsed IS NOT NULL", (pattern,)).rowcount
+
+    def iter_bodies(self, pattern: str = '%') -> Iterator[Tuple[str, str]]:
+        """Yield (url, body) for cached URLs matching a SQL LIKE pattern."""
+        with self._lock:
+            urls = [row[0] for row in self._conn.execute(
+                "SELECT url FROM responses WHERE url LIKE ? ORDER BY url", (pattern,))]
+        for url in urls:
+            with self._lock:
+                row = self._conn.execute("SELECT body FROM responses WHERE url = ?", (url,)).fetchone()
+            if row:
+                yield url, zlib.decompress(row[0]).decode('utf-8')
+
+    def evict(self) -> int:
+        """Drop expired entries, then least recently used ones until under `max_bytes`."""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM responses WHERE fetched_at < ?", (time.time() - self.max_age,)).rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - self.max_bytes
+                doomed = []
+                for url, size in self._conn.execute("SELECT url, size FROM responses ORDER BY accessed_at"):
+                    if excess <= 0:
+                        break
+                    doomed.append((url,))
+                    excess -= size
+                self._conn.executemany("DELETE FROM responses WHERE url = ?", doomed)
+                removed += len(doomed)
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+PRODUCT_URL_PATTERN = re.compile(r'/products/details/(\d+)$')
+
+
+class PageArchive:
+    """Append-only archive of every fetched page, for re-parsing without the network.
+
+    Each process appends zlib-compressed bodies to its own segment files
+    (`<host>-<pid>-NNNNN.seg`, rotated at `segment_bytes`) and one fixed-width
+    entry per page to `<host>-<pid>.idx`:
+
+        url key (16-byte BLAKE2b), content key (8-byte BLAKE2b), product ID,
+        fetched-at timestamp, segment number, offset, compressed length
+
+    On open the index files are memory-mapped and folded into lookups by URL
+    and by product ID; the latest fetch of a URL wins. A page whose content
+    matches the latest archived copy is not stored again. A torn trailing
+    index entry (crash mid-write) is ignored.
+    """
+
+    ENTRY = struct.Struct('<16s8sQdIQI')
+
+    def __init__(self, directory: str = 'page_archive', segment_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.tag = f"{socket.gethostname()}-{os.getpid()}"
+        self.pages_written = 0
+        self.bytes_written = 0
+        # url key -> (fetched_at, content key, product ID, segment path, offset, length)
+        self._entries: Dict[bytes, Tuple[float, bytes, int, str, int, int]] = {}
+        self._products: Dict[int, bytes] = {}
+        self._segment_no = 0
+        self._segment = None
+        self._segment_size = 0
+        self._index = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def url_key(url: str) -> bytes:
+        return hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+
+    def _segment_path(self, tag: str, segment_no: int) -> str:
+        return os.path.join(self.directory, f"{tag}-{segment_no:05d}.seg")
+
+    def _remember(self, url_key: bytes, entry: Tuple[float, bytes, int, str, int, int]):
+        current = self._entries.get(url_key)
+        if current is None or entry[0] >= current[0]:
+            self._entries[url_key] = entry
+            if entry[2]:
+                self._products[entry[2]] = url_key
+
+    def _load(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.idx'):
+                continue
+            path = os.path.join(self.directory, name)
+            size = os.path.getsize(path)
+            usable = size - size % self.ENTRY.size
+            if not usable:
+                continue
+            tag = name[:-len('.idx')]
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                entries = memoryview(view)[:usable]
+                try:
+                    for url_key, content_key, product_id, fetched_at, segment_no, offset, length in self.ENTRY.iter_unpack(entries):
+                        self._remember(url_key, (fetched_at, content_key, product_id,
+                                                 self._segment_path(tag, segment_no), offset, length))
+                finally:
+                    entries.release()
+
+    def _rotate(self):
+        if self._segment:
+            self._segment.close()
+        self._segment_no += 1
+        self._segment = open(self._segment_path(self.tag, self._segment_no), 'ab')
+        self._segment_size = self._segment.tell()
+        if self._index is None:
+            self._index = open(os.path.join(self.directory, f"{self.tag}.idx"), 'ab')
+
+    def append(self, url: str, text: str) -> bool:
+        """Archive a fetched page; returns False if it matches the latest archived copy."""
+        body = text.encode('utf-8')
+        url_key = self.url_key(url)
+        content_key = hashlib.blake2b(body, digest_size=8).digest()
+        match = PRODUCT_URL_PATTERN.search(url)
+        product_id = int(match.group(1)) if match else 0
+        with self._lock:
+            current = self._entries.get(url_key)
+            if current is not None and current[1] == content_key:
+                return False
+            record = zlib.compress(body)
+            if self._segment is None or self._segment_size + len(record) > self.segment_bytes:
+                self._rotate()
+            offset = self._segment_size
+            # The body goes in before its index entry, so an indexed page is always complete.
+            self._segment.write(record)
+            self._segment.flush()
+            self._segment_size += len(record)
+            fetched_at = time.time()
+            self._index.write(self.ENTRY.pack(url_key, content_key, product_id, fetched_at,
+                                              self._segment_no, offset, len(record)))
+            self._index.flush()
+            self._remember(url_key, (fetched_at, content_key, product_id, self._segment.name, offset, len(record)))
+            self.pages_written += 1
+            self.bytes_written += len(record)
+        return True
+
+    @staticmethod
+    def read(path: str, offset: int, length: int) -> str:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return zlib.decompress(f.read(length)).decode('utf-8')
+
+    def locate(self, url: str) -> Optional[Tuple[str, int, int]]:
+        """(segment path, offset, length) of the latest copy of `url`."""
+        entry = self._entries.get(self.url_key(url))
+        return entry[3:] if entry else None
+
+    def locate_product(self, product_id: str) -> Optional[Tuple[str, int, int]]:
+        url_key = self._products.get(int(product_id)) if product_id.isdigit() else None
+        return self._entries[url_key][3:] if url_key else None
+
+    def get(self, url: str) -> Optional[str]:
+        location = self.locate(url)
+        return self.read(*location) if location else None
+
+    def product_count(self) -> int:
+        return len(self._products)
+
+    def sync(self):
+        with self._lock:
+            for f in (self._segment, self._index):
+                if f:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            for f in (self._segment, self._index):
+                if f:
+                    f.close()
+            self._segment = self._index = None
+
+
+def parse_archived_pages(backend: str, pages: List[Tuple[str, str, int, int]]) -> List[Tuple[str, Optional[Dict], Optional[str]]]:
+    """Reparse stage entry point: parse (product_id, segment path, offset, length) pages in a worker process.
+
+    Pages are read from the archive by the worker, so only their locations
+    cross the process boundary. Returns (product_id, record or None, error).
+    """
+    results = []
+    for product_id, path, offset, length in pages:
+        try:
+            content = PageArchive.read(path, offset, length)
+        except (OSError, zlib.error) as e:
+            results.append((product_id, None, str(e)))
+            continue
+        record, _, error = parse_product_page(backend, product_id, content)
+        results.append((product_id, record, error))
+    return results
+
+
+INGREDIENT_PAGE_PATTERN = re.compile(r'/ingredients\?(?:.*&)?page=(\d+)')
+
 
 class NAFDACScraper:
-    def __init__(self):
+    def __init__(self, max_concurrency: int = 8, per_host_concurrency: int = 4,
+                 retry_policy: Optional[RetryPolicy] = None, request_timeout: float = 30.0,
+                 initial_rate: float = 2.0, min_rate: float = 0.2, max_rate: float = 20.0,
+                 response_cache: Optional[ResponseCache] = None, parser_backend: Optional[str] = None,
+                 parse_workers: Optional[int] = None, page_archive: Optional[PageArchive] = None):
         self.base_url = "https://greenbook.nafdac.gov.ng"
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
-        
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[500, 502, 503, 504]
-        )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
-        self.session.mount("http://", adapter)
-        self.session.mount("https://", adapter)
+
+        # Fetch engine: a thread pool keeps up to `max_concurrency` requests in
+        # flight overall, and never more than `per_host_concurrency` per host.
+        self.max_concurrency = max(1, max_concurrency)
+        self.per_host_concurrency = max(1, min(per_host_concurrency, self.max_concurrency))
+        self._global_slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._host_slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._host_lock = threading.Lock()
+        self._thread_local = threading.local()
+
+        # One retry budget per request; the host circuit breaker pauses the
+        # whole crawl during outages instead of burning the budget.
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.request_timeout = request_timeout
+        self._circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+        # Politeness: per-host request rate, adjusted by AIMD from response health.
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._rate_limiters: Dict[str, AdaptiveRateLimiter] = {}
+        self.rate_limit_file = 'rate_limit_log.json'
+        # Optional observer called as request_hook(url, status or None, seconds) for every HTTP attempt.
+        self.request_hook: Optional[Callable[[str, Optional[int], float], None]] = None
+
+        # Conditional re-crawls: unchanged pages reuse the previously parsed record.
+        self.response_cache = response_cache
+        self.parser = make_parser(parser_backend)
+        if self.response_cache:
+            self.response_cache.parser_version = self.parser.version
+        # Parsing runs in a process pool (0 parses inline on the main thread).
+        self.parse_workers = (os.cpu_count() or 1) if parse_workers is None else parse_workers
+        self.stage_stats: Dict[str, StageStats] = {}
+        # Raw pages are archived so extraction changes can be replayed offline (--reparse).
+        self.page_archive = page_archive
+
+        self.metrics = ScraperMetrics()
+        self.metrics.add_collector(self._collect_metrics)
+        self._crawl_started: Optional[float] = None
+        self._ingredients_total = 0
+        self._ingredients_estimated = False
+        self.listing_prefetch = 4
+        self._ingredients_done = 0
         
         self.progress_file = 'scraping_progress.json'
+        self.checkpoints = CheckpointStore('scraping_checkpoint.db')
+        self.validation_log_file = 'validation_log.json'
+        self.products_file = 'nafdac_products.json'
+        self.product_writer = ProductStreamWriter('nafdac_products.jsonl')
+        self.snapshot_file = 'nafdac_snapshot.json'
+        self.changes_file = 'nafdac_changes.jsonl'
         self.checkpoint_interval = 100
         self.current_progress = self.get_initial_progress()
         
+        # Field masks of the written products; validation_log's missing_* lists are derived from them.
+        self.product_columns = ProductColumns()
         self.validation_log = {
             'missing_manufacturer': [],
             'missing_nafdac': [],
@@ -41,132 +2418,394 @@ class NAFDACScraper:
         }
 
     def get_initial_progress(self):
+        # Per-item state (processed ingredients/brands, failures) lives in self.checkpoints.
         return {
             'last_saved_page': 0,
-            'processed_ingredients': [],
-            'processed_brands': [],
             'total_products': 0,
-            'last_save_time': None,
-            'failed_scrapes': []
+            'last_save_time': None
         }
 
+    def reset_progress(self):
+        self.current_progress = self.get_initial_progress()
+        self.checkpoints.reset()
+        self.product_writer.reset()
+        self.product_columns = ProductColumns()
+
+    def load_progress(self):
+        """Resume from the checkpoint store, migrating a legacy scraping_progress.json if needed."""
+        if not self.checkpoints.has_state() and os.path.exists(self.progress_file):
+            with open(self.progress_file, 'r') as f:
+                legacy_progress = json.load(f)
+            self.checkpoints.import_progress(legacy_progress)
+            for key in self.get_initial_progress():
+                if key in legacy_progress:
+                    self.current_progress[key] = legacy_progress[key]
+            self.checkpoints.set_meta('progress', self.current_progress)
+        self.current_progress = self.checkpoints.get_meta('progress', self.get_initial_progress())
+        # Products from earlier sessions count towards the validation summary.
+        self.product_columns = ProductColumns()
+        self.product_columns.extend(self.product_writer.iter_products())
+
+    def export_progress(self):
+        self.checkpoints.export_progress(self.current_progress, self.progress_file)
+
     def validate_product(self, product_data: Dict) -> Tuple[bool, List[str]]:
-        required_fields = {
-            'manufacturer': 'Manufacturer Name',
-            'nafdacNumber': 'NAFDAC Registration Number',
-            'brandName': 'Brand Name',
-            'strength': 'Strength',
-            'dosageForm': 'Dosage Form'
-        }
-        missing_fields = []
-        for field, field_name in required_fields.items():
-            if not product_data.get(field):
-                missing_fields.append(field_name)
+        mask = field_mask(product_data)
+        missing_fields = [label for field, label in REQUIRED_FIELDS if not mask & FIELD_BITS[field]]
         return len(missing_fields) == 0, missing_fields
 
     def calculate_quality_score(self, product_data: Dict) -> float:
-        required_fields = {
-            'manufacturer': 0.25,
-            'nafdacNumber': 0.25,
-            'brandName': 0.15,
-            'strength': 0.15,
-            'dosageForm': 0.10,
-            'packSize': 0.05,
-            'countryOfOrigin': 0.05
-        }
-        score = 0.0
-        for field, weight in required_fields.items():
-            if product_data.get(field):
-                score += weight
-        return score
+        return SCORE_TABLE[field_mask(product_data)]
 
-    def save_progress(self, products: List[Dict]):
+    def update_validation_log(self):
+        """Rebuild the missing-field lists and summary from the product columns."""
+        for key, field in VALIDATION_LOG_FIELDS.items():
+            self.validation_log[key] = self.product_columns.missing_ids(field)
+        self.validation_log['summary'] = self.product_columns.summary()
+
+    def save_progress(self):
+        """Checkpoint: fsync the product stream and atomically rewrite the small state files."""
+        started = time.perf_counter()
+        self.product_writer.sync()
+        if self.page_archive:
+            self.page_archive.sync()
         self.current_progress['last_save_time'] = datetime.now().isoformat()
-        self.current_progress['total_products'] = len(products)
-        
-        with open(self.progress_file, 'w') as f:
-            json.dump(self.current_progress, f, indent=2)
-        
-        products_with_scores = []
-        for product in products:
-            product['qualityScore'] = self.calculate_quality_score(product)
-            products_with_scores.append(product)
-        
-        with open('nafdac_products.json', 'w', encoding='utf-8') as f:
-            json.dump(products_with_scores, f, ensure_ascii=False, indent=2)
-            
-        with open('validation_log.json', 'w') as f:
-            json.dump(self.validation_log, f, indent=2)
+        self.current_progress['total_products'] = self.product_writer.count
+
+        self.checkpoints.set_meta('progress', self.current_progress)
+        self.update_validation_log()
+        atomic_write_json(self.validation_log_file, self.validation_log, indent=2)
+
+        if self.response_cache:
+            evicted = self.response_cache.evict()
+            logger.info("Response cache: %d unchanged, %d changed pages, %d entries evicted",
+                        self.response_cache.hits, self.response_cache.misses, evicted)
+
+        rate_limit_stats = self.rate_limit_stats()
+        atomic_write_json(self.rate_limit_file, rate_limit_stats, indent=2)
+        for host, stats in rate_limit_stats.items():
+            logger.info("Rate limit for %s: %s req/s (peak %s, %d decreases, %d Retry-After pauses)",
+                        host, stats['rate'], stats['peak_rate'], stats['decreases'], stats['retry_after_pauses'])
+        self.metrics.observe('checkpoint_seconds', time.perf_counter() - started)
+
+    def finalize_output(self) -> int:
+        """Produce the legacy nafdac_products.json array read by scripts/import-nafdac-json.ts."""
+        return self.product_writer.finalize(self.products_file)
+
+    def load_snapshot(self) -> SnapshotIndex:
+        """The previous delta snapshot; must be loaded before finalize_output replaces nafdac_products.json."""
+        snapshot = SnapshotIndex(self.snapshot_file)
+        if not snapshot.load(self.products_file):
+            logger.info("No previous snapshot, every product will be reported as added")
+        return snapshot
+
+    def write_change_feed(self, snapshot: SnapshotIndex) -> Dict[str, int]:
+        """Write the added/modified/removed feed for this crawl and advance the snapshot."""
+        failed = self.checkpoints.ids(CheckpointStore.PRODUCT, CheckpointStore.FAILED)
+        complete = self.discovery_complete()
+        if not complete:
+            logger.warning("Some ingredient listings could not be fetched; products missing from this crawl "
+                           "are kept in the snapshot instead of being reported as removed")
+        counts = snapshot.write_changes(self.product_writer.iter_products(), self.changes_file, keep_ids=failed,
+                                        keep_missing=not complete)
+        snapshot.save()
+        return counts
+
+    def discovery_complete(self) -> bool:
+        """Whether every ingredient listing page and every ingredient's brand listing was fetched."""
+        return (bool(self.checkpoints.get_meta('listing_complete', False))
+                and self.checkpoints.count(CheckpointStore.INGREDIENT, CheckpointStore.FAILED) == 0)
+
+    @property
+    def session(self) -> requests.Session:
+        # requests.Session is not safe to share between threads, so every
+        # fetch worker gets its own session (and connection pool).
+        session = getattr(self._thread_local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            # Retries are handled by get_page's RetryPolicy, not urllib3.
+            adapter = InstrumentedHTTPAdapter(max_retries=0, pool_maxsize=self.per_host_concurrency)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._thread_local.session = session
+        return session
+
+    def _for_host(self, registry: Dict, url: str, factory: Callable):
+        host = urlparse(url).netloc
+        with self._host_lock:
+            value = registry.get(host)
+            if value is None:
+                value = factory()
+                registry[host] = value
+            return value
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        return self._for_host(self._host_slots, url, lambda: threading.BoundedSemaphore(self.per_host_concurrency))
+
+    def circuit_breaker(self, url: str) -> CircuitBreaker:
+        return self._for_host(self._circuit_breakers, url, CircuitBreaker)
+
+    def rate_limiter(self, url: str) -> AdaptiveRateLimiter:
+        return self._for_host(self._rate_limiters, url, lambda: AdaptiveRateLimiter(
+            rate=self.initial_rate, min_rate=self.min_rate, max_rate=self.max_rate))
+
+    def rate_limit_stats(self) -> Dict[str, Dict]:
+        with self._host_lock:
+            limiters = dict(self._rate_limiters)
+        return {host: limiter.snapshot() for host, limiter in limiters.items()}
+
+    def _ordered_map(self, submit: Callable[[object], Future], items: Iterable, window: Optional[int] = None,
+                     stats: Optional[StageStats] = None) -> Iterator[Tuple[object, object]]:
+        """Yield (item, result) in input order while keeping up to `window` submissions in flight.
 
-    def get_page(self, url: str, max_retries: int = 3) -> Optional[str]:
-        for attempt in range(max_retries):
-            time.sleep(random.uniform(1, 3))
+        `submit` returns a Future for an item. The bounded window is the stage's
+        queue: upstream items are only pulled when there is room, which gives
+        backpressure across chained stages.
+        """
+        window = window or self.max_concurrency * 2
+        iterator = iter(items)
+        pending = deque()
+        for item in iterator:
+            pending.append((item, submit(item)))
+            if len(pending) >= window:
+                break
+        while pending:
+            if stats:
+                stats.queued = len(pending)
+            item, future = pending.popleft()
+            result = future.result()
+            next_item = next(iterator, _EXHAUSTED)
+            if next_item is not _EXHAUSTED:
+                pending.append((next_item, submit(next_item)))
+            yield item, result
+        if stats:
+            stats.queued = 0
+
+    def get_page(self, url: str, retry_key: Optional[str] = None,
+                 retry_policy: Optional[RetryPolicy] = None) -> Optional[str]:
+        result = self.fetch(url, retry_key, retry_policy)
+        return result.text if result else None
+
+    def fetch(self, url: str, retry_key: Optional[str] = None, retry_policy: Optional[RetryPolicy] = None,
+              conditional: bool = True) -> Optional[FetchResult]:
+        """Fetch `url` within a single retry budget.
+
+        Connection errors, timeouts, 429 and 5xx responses are retried with
+        jittered backoff until the policy's attempt or time budget runs out; other
+        HTTP errors fail immediately, and an empty 200 body counts as a retryable
+        failure. Requests that needed more than one attempt
+        (or failed) are recorded in validation_log['retry_attempts'] under
+        `retry_key` (defaults to the URL). With a response cache, the request is
+        revalidated with If-None-Match/If-Modified-Since unless `conditional` is
+        False.
+        """
+        policy = retry_policy or self.retry_policy
+        breaker = self.circuit_breaker(url)
+        limiter = self.rate_limiter(url)
+        host_slot = self._host_slot(url)
+        cache = self.response_cache
+        request_headers = cache.validators(url) if cache and conditional else {}
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            paused_at = time.monotonic()
+            probe = breaker.acquire()
+            # Time spent paused by the breaker doesn't count against the budget.
+            started += time.monotonic() - paused_at
+            limiter.acquire()
+            retryable = True
+            retry_after = None
+            if attempt > 1:
+                self.metrics.inc('retries_total')
+            _request_context.metrics = self.metrics
             try:
-                response = self.session.get(url)
-                response.raise_for_status()
-                return response.text
+                with self._global_slots, host_slot:
+                    sent_at = time.monotonic()
+                    response = self.session.get(url, headers=request_headers, timeout=self.request_timeout, stream=True)
+                    ttfb = time.monotonic() - sent_at
+                    content = response.content
+                    latency = time.monotonic() - sent_at
+                self.metrics.inc('requests_total', status=response.status_code)
+                self.metrics.observe('ttfb_seconds', ttfb)
+                self.metrics.observe('download_seconds', latency - ttfb)
+                self.metrics.observe('request_seconds', latency)
+                self.metrics.observe('page_bytes', len(content), buckets=BYTES_BUCKETS)
+                self.metrics.inc('bytes_total', len(content))
             except requests.RequestException as e:
-                print(f"Error fetching {url} (attempt {attempt + 1}/{max_retries}): {e}")
-                if attempt == max_retries - 1:
-                    return None
-                time.sleep(2 ** attempt)
-        return None
+                self.metrics.inc('requests_total', status='error')
+                if self.request_hook:
+                    self.request_hook(url, None, time.monotonic() - sent_at)
+                breaker.record(False, probe)
+                limiter.on_throttle('timeout' if isinstance(e, requests.Timeout) else 'connection error')
+                error = str(e)
+            else:
+                if self.request_hook:
+                    self.request_hook(url, response.status_code, latency)
+                if response.status_code in RETRYABLE_STATUSES:
+                    breaker.record(False, probe)
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    limiter.on_throttle(f"HTTP {response.status_code}", retry_after)
+                    error = f"HTTP {response.status_code}"
+                elif response.ok and not content.strip():
+                    # A blank 200 is a failed page, not a product without data: retry it, never cache or archive it.
+                    breaker.record(False, probe)
+                    error = "empty response body"
+                else:
+                    # Any other answer means the host itself is healthy.
+                    breaker.record(True, probe)
+                    limiter.on_success(latency)
+                    result = None
+                    blank_cached = False
+                    if response.status_code == 304 and cache:
+                        result = cache.revalidated(url)
+                        if result and not result.text.strip():
+                            # Blank body cached before blank pages were rejected: fetch it unconditionally.
+                            request_headers = {}
+                            result = None
+                            blank_cached = True
+                    elif response.ok and cache:
+                        result = cache.store(url, response.text, response.headers.get('ETag'),
+                                             response.headers.get('Last-Modified'))
+                    elif response.ok:
+                        result = FetchResult(url, response.text)
+                    if result:
+                        if self.page_archive:
+                            self.page_archive.append(url, result.text)
+                        if attempt > 1:
+                            self.validation_log['retry_attempts'][retry_key or url] = attempt
+                        return result
+                    if blank_cached:
+                        error = "empty cached body"
+                    else:
+                        retryable = False
+                        error = f"HTTP {response.status_code}"
 
-    def get_active_ingredients(self):
-        all_ingredients = []
-        page = self.current_progress['last_saved_page'] + 1
-        
-        while True:
-            url = f"{self.base_url}/ingredients?page={page}"
-            print(f"\nFetching ingredients page {page}...")
-            content = self.get_page(url)
-            if not content:
-                break
+            logger.warning("Error fetching %s (attempt %d/%d): %s", url, attempt, policy.max_attempts, error)
+            delay = max(policy.backoff(attempt), retry_after or 0)
+            if not retryable or not policy.allows_retry(attempt, started, delay):
+                self.validation_log['retry_attempts'][retry_key or url] = attempt
+                self.metrics.inc('fetch_failures_total')
+                return None
+            time.sleep(delay)
 
-            soup = BeautifulSoup(content, 'html.parser')
-            ingredients_on_page = []
-            
-            for link in soup.find_all('a', href=re.compile(r'/ingredient/products/\d+')):
-                ingredient_id = link['href'].split('/')[-1]
-                ingredients_on_page.append({
-                    'id': ingredient_id,
-                    'name': link.text.strip()
-                })
-            
-            if not ingredients_on_page:
-                break
-                
-            all_ingredients.extend(ingredients_on_page)
-            print(f"Found {len(ingredients_on_page)} ingredients on page {page}")
-            
-            next_page_link = soup.find('a', string='›') # Standard 'next' arrow
-            if not next_page_link:
-                 # Check for alternative next page link if the site uses different pagination markers
-                next_page_link = soup.find('a', {'rel': 'next'}) 
-            if not next_page_link:
-                break
-            page += 1
-            self.current_progress['last_saved_page'] = page -1 # Update last successfully processed page
-            
-        return all_ingredients
+    @staticmethod
+    def parse_ingredient_page(content: str) -> Tuple[List[Dict], int, bool]:
+        """Return (ingredients, highest page number linked, has next page) for a listing page."""
+        soup = BeautifulSoup(content, 'html.parser')
+        ingredients = []
+        for link in soup.find_all('a', href=re.compile(r'/ingredient/products/\d+')):
+            ingredient_id = link['href'].split('/')[-1]
+            ingredients.append({
+                'id': ingredient_id,
+                'name': link.text.strip()
+            })
+
+        last_page = 0
+        for link in soup.find_all('a', href=INGREDIENT_PAGE_PATTERN):
+            last_page = max(last_page, int(INGREDIENT_PAGE_PATTERN.search(link['href']).group(1)))
+
+        next_page_link = soup.find('a', string='›') # Standard 'next' arrow
+        if not next_page_link:
+            # Check for alternative next page link if the site uses different pagination markers
+            next_page_link = soup.find('a', {'rel': 'next'})
+        return ingredients, last_page, next_page_link is not None
+
+    def get_ingredient_page(self, page: int) -> Optional[Tuple[List[Dict], int, bool]]:
+        logger.info("Fetching ingredients page %d...", page)
+        content = self.get_page(f"{self.base_url}/ingredients?page={page}")
+        if not content:
+            return None
+        return self.parse_ingredient_page(content)
+
+    def iter_active_ingredients(self, executor: ThreadPoolExecutor) -> Iterator[Dict]:
+        """Yield active ingredients in listing order as their pages arrive.
+
+        The first page's pagination gives the last page number, so the remaining
+        pages are fetched concurrently (at most `max_concurrency` ahead of the
+        consumer). Beyond the last numbered page, while pages still link to a
+        next one, up to `listing_prefetch` pages are requested speculatively.
+        Each ingredient carries its listing `page`; the last one on a page is
+        flagged `last_on_page`. `_ingredients_total` holds a running estimate.
+        The checkpoint store's 'listing_complete' meta records whether the
+        listing was read to its end rather than cut short by a failed page.
+        """
+        first_page = page = self.current_progress['last_saved_page'] + 1
+        pending = deque([(page, executor.submit(self.get_ingredient_page, page))])
+        next_page = page + 1
+        last_known = page
+        seen = 0
+        complete = False
+        self._ingredients_estimated = True
+        self.checkpoints.set_meta('listing_complete', False)
+        try:
+            while pending:
+                page, future = pending.popleft()
+                result = future.result()
+                if not result:
+                    logger.warning("Could not fetch ingredients page %d, the rest of the listing is skipped", page)
+                    break
+                if not result[0]:
+                    complete = True
+                    break
+                ingredients, last_page, has_next = result
+                logger.info("Found %d ingredients on page %d", len(ingredients), page)
+
+                if has_next:
+                    last_known = max(last_known, last_page)
+                    # Speculate only once the numbered pages run out.
+                    limit = last_known if page < last_known else page + self.listing_prefetch
+                    while len(pending) < self.max_concurrency and next_page <= limit:
+                        pending.append((next_page, executor.submit(self.get_ingredient_page, next_page)))
+                        next_page += 1
+
+                seen += len(ingredients)
+                self._ingredients_total = seen + round(seen / (page - first_page + 1) * max(0, last_known - page))
+                if not has_next:
+                    self._ingredients_total = seen
+                    self._ingredients_estimated = False
+
+                for i, ingredient in enumerate(ingredients):
+                    ingredient['page'] = page
+                    ingredient['last_on_page'] = i == len(ingredients) - 1
+                    yield ingredient
+                if not has_next:
+                    complete = True
+                    break
+        finally:
+            # Speculative requests past the end are no longer needed.
+            for _, future in pending:
+                future.cancel()
+        self._ingredients_total = seen
+        self._ingredients_estimated = False
+        self.checkpoints.set_meta('listing_complete', complete)
+
+    def get_active_ingredients(self):
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            return list(self.iter_active_ingredients(executor))
 
-    def get_brands_for_ingredient(self, ingredient_id):
-        if ingredient_id in self.current_progress['processed_ingredients']:
-            print(f"Skipping already processed ingredient {ingredient_id}")
+    def get_brands_for_ingredient(self, ingredient_id) -> Optional[List[Dict]]:
+        """Brands of an ingredient not yet processed; None when its listing could not be fetched."""
+        if self.checkpoints.is_done(CheckpointStore.INGREDIENT, ingredient_id):
+            logger.debug("Skipping already processed ingredient %s", ingredient_id)
             return []
 
         url = f"{self.base_url}/ingredient/products/{ingredient_id}"
         content = self.get_page(url)
         if not content:
-            return []
+            return None
+        return [brand for brand in self.parse_brand_listing(content)
+                if not self.checkpoints.is_done(CheckpointStore.PRODUCT, brand['id'])]
 
+    @staticmethod
+    def parse_brand_listing(content: str) -> List[Dict]:
+        """Brands (id, name, strength, dosageForm) linked from an ingredient's product listing."""
         soup = BeautifulSoup(content, 'html.parser')
         brands = []
         
         for link in soup.find_all('a', href=re.compile(r'/products/details/\d+')):
             brand_id = link['href'].split('/')[-1]
-            if brand_id in self.current_progress['processed_brands']:
-                continue
             
             text_parts = link.text.strip().split('##')
             brand_name = text_parts[0].strip()
@@ -186,289 +2825,896 @@ class NAFDACScraper:
                 'strength': strength,
                 'dosageForm': dosage_form
             })
-        
-        # self.current_progress['processed_ingredients'].append(ingredient_id) # Mark ingredient as processed
         return brands
 
-    def get_product_details(self, product_id: str, max_retries: int = 3) -> Optional[Dict]:
-        for attempt in range(max_retries):
-            product_data = self._scrape_product_details(product_id)
-            if product_data:
-                is_valid, missing_fields = self.validate_product(product_data)
-                if missing_fields:
-                    print(f"Product {product_id} missing fields: {', '.join(missing_fields)}")
-                    for field in missing_fields:
-                        if field == 'Manufacturer Name':
-                            self.validation_log['missing_manufacturer'].append(product_id)
-                        elif field == 'NAFDAC Registration Number':
-                            self.validation_log['missing_nafdac'].append(product_id)
-                        elif field == 'Strength':
-                            self.validation_log['missing_strength'].append(product_id)
-                        elif field == 'Dosage Form':
-                            self.validation_log['missing_dosage_form'].append(product_id)
-                return product_data
-            
-            if attempt < max_retries - 1:
-                print(f"Retrying product {product_id} (attempt {attempt + 1}/{max_retries})")
-                time.sleep(2 ** attempt)
-                continue
-            
-            self.validation_log['retry_attempts'][product_id] = attempt + 1
-            return None
-        return None
+    def get_product_details(self, product_id: str) -> Optional[Dict]:
+        """Fetch and parse one product page. Brand listing fields are not merged in and the
+        product is not counted in the validation summary; the crawl does both when it writes it."""
+        return self._scrape_product_details(product_id)
+
+    def _record_validation(self, product_id: str, product_data: Dict) -> float:
+        """Add a finished product to the product columns; returns its quality score."""
+        mask = self.product_columns.add(product_data)
+        if mask & ALL_FIELDS_MASK != ALL_FIELDS_MASK and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Product %s missing fields: %s", product_id,
+                         ', '.join(label for field, label in REQUIRED_FIELDS if not mask & FIELD_BITS[field]))
+        return SCORE_TABLE[mask]
+
+    def _log_product_details(self, product_data: Dict):
+        # Hot path: skip formatting entirely unless debug logging is on.
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        logger.debug("Product %s details: brand=%r manufacturer=%r nafdac=%r country=%r strength=%r dosageForm=%r",
+                     product_data['id'], product_data['brandName'], product_data['manufacturer'],
+                     product_data['nafdacNumber'], product_data['countryOfOrigin'],
+                     product_data['strength'], product_data['dosageForm'])
 
     def _scrape_product_details(self, product_id: str) -> Optional[Dict]:
         url = f"{self.base_url}/products/details/{product_id}"
-        content = self.get_page(url)
-        if not content:
+        result = self.fetch(url, retry_key=product_id)
+        if not result:
             return None
+        if result.unchanged and result.cached_record:
+            # Page unchanged since the last crawl: reuse the parsed record.
+            return dict(result.cached_record)
 
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        product_data = {
-            'id': product_id,
-            'brandName': '',
-            'manufacturer': '',
-            'nafdacNumber': '',
-            'type': 'prescription', 
-            'dateAdded': datetime.now().strftime('%Y-%m-%d'),
-            'verified': True,
-            'rating': 4.0,
-            'bioequivalence': 'pending',
-            'countryOfOrigin': 'Nigeria', # Default
-            'strength': '',
-            'dosageForm': '',
-            'packSize': '',
-            'image': '/placeholder.svg',
-            'suppliers': []
-        }
+        try:
+            product_data = self.parser.parse(product_id, result.text)
+        except Exception as e:
+            logger.warning("Error parsing product details for ID %s: %s", product_id, e)
+            return None
+
+        self._log_product_details(product_data)
+        if self.response_cache:
+            self.response_cache.store_parsed(url, product_data)
+        return product_data
+
+    def _iter_brand_jobs(self, executor: ThreadPoolExecutor, ingredients: Iterable[Dict]) -> Iterator[Tuple[int, Dict, Optional[Dict], bool]]:
+        """Yield (ingredient index, ingredient, brand, is_last_brand) in crawl order.
+
+        Brand lists are fetched concurrently ahead of the consumer; an ingredient
+        without brands yields a single job with `brand=None` so it is still marked
+        as processed in order. An ingredient whose listing could not be fetched
+        is flagged `listing_failed`. A brand listed under several ingredients is
+        only yielded under the first, as in a serial crawl; listings run ahead
+        of the writer, so the checkpoint store can't catch these yet.
+        """
+        stats = self.stage_stats['listing']
+        seen = set()
+
+        def fetch_brands(ingredient):
+            started = time.perf_counter()
+            brands = self.get_brands_for_ingredient(ingredient['id'])
+            stats.record(time.perf_counter() - started)
+            return brands
+
+        brand_lists = self._ordered_map(lambda ingredient: executor.submit(fetch_brands, ingredient), ingredients, stats=stats)
+        for idx, (ingredient, brands) in enumerate(brand_lists):
+            logger.info("[%d/%s%d] Processing ingredient: %s (ID: %s)", idx + 1, '~' if self._ingredients_estimated else '',
+                        self._ingredients_total, ingredient['name'], ingredient['id'])
+            if brands is None:
+                logger.warning("Could not fetch the brand listing of %s (ID: %s)", ingredient['name'], ingredient['id'])
+                ingredient['listing_failed'] = True
+                brands = []
+            logger.debug("Found %d brands for %s", len(brands), ingredient['name'])
+            brands = [brand for brand in brands if brand['id'] not in seen]
+            seen.update(brand['id'] for brand in brands)
+            if not brands:
+                yield idx, ingredient, None, True
+            for bidx, brand in enumerate(brands):
+                yield idx, ingredient, brand, bidx == len(brands) - 1
+
+    def _fetch_product_page(self, product_id: str) -> Optional[FetchResult]:
+        """Fetch stage: I/O only, runs on the fetch thread pool."""
+        started = time.perf_counter()
+        result = self.fetch(f"{self.base_url}/products/details/{product_id}", retry_key=product_id)
+        self.stage_stats['fetch'].record(time.perf_counter() - started)
+        return result
+
+    def _submit_fetch(self, executor: ThreadPoolExecutor, job) -> Future:
+        _, _, brand, _ = job
+        if brand is None:
+            return completed_future(None)
+        return executor.submit(self._fetch_product_page, brand['id'])
+
+    def _submit_parse(self, executor: Optional[ProcessPoolExecutor], fetched) -> Future:
+        """Parse stage: CPU-bound, runs on the process pool (or inline without one)."""
+        (_, _, brand, _), result = fetched
+        if result is None:
+            return completed_future(None)
+        if result.unchanged and result.cached_record:
+            # Page unchanged since the last crawl: reuse the parsed record.
+            return completed_future((dict(result.cached_record), None, None))
+        if executor is None:
+            return completed_future(parse_product_page(self.parser.name, brand['id'], result.text))
+        return executor.submit(parse_product_page, self.parser.name, brand['id'], result.text)
+
+    def _merge_brand_fields(self, product_details: Dict, ingredient: Dict, brand: Dict):
+        product_details['genericName'] = ingredient['name']
+        if brand['strength'] and not product_details['strength']: # Prioritize section-parsed, then brand list
+            product_details['strength'] = brand['strength']
+        if brand['dosageForm'] and not product_details['dosageForm']: # Prioritize section-parsed, then brand list
+            product_details['dosageForm'] = brand['dosageForm']
 
-        def normalize(text):
-            if not text:
-                return ''
-            return ' '.join(text.replace('\xa0', ' ').split())
+    def eta_seconds(self) -> Optional[float]:
+        """Remaining crawl time extrapolated from the ingredients finished so far."""
+        if not self._crawl_started or not self._ingredients_done or not self._ingredients_total:
+            return None
+        elapsed = time.monotonic() - self._crawl_started
+        remaining = max(0, self._ingredients_total - self._ingredients_done)
+        return elapsed / self._ingredients_done * remaining
+
+    def _collect_metrics(self, metrics: ScraperMetrics):
+        for name, stats in self.stage_stats.items():
+            metrics.set_gauge('stage_items', stats.items, stage=name)
+            metrics.set_gauge('stage_busy_seconds', stats.busy, stage=name)
+            metrics.set_gauge('queue_depth', stats.queued, stage=name)
+        with self._host_lock:
+            limiters = dict(self._rate_limiters)
+            breakers = dict(self._circuit_breakers)
+        for host, limiter in limiters.items():
+            metrics.set_gauge('rate_limit_rps', limiter.rate, host=host)
+        for host, breaker in breakers.items():
+            metrics.set_gauge('circuit_open', 0 if breaker.state == CircuitBreaker.CLOSED else 1, host=host)
+            metrics.set_gauge('circuit_trips', breaker.trips, host=host)
+        if self.response_cache:
+            metrics.set_gauge('cache_unchanged_pages', self.response_cache.hits)
+            metrics.set_gauge('cache_changed_pages', self.response_cache.misses)
+        if self.page_archive:
+            metrics.set_gauge('archive_pages_written', self.page_archive.pages_written)
+            metrics.set_gauge('archive_bytes_written', self.page_archive.bytes_written)
+        metrics.set_gauge('ingredients_total', self._ingredients_total)
+        metrics.set_gauge('ingredients_done', self._ingredients_done)
+        metrics.set_gauge('products_written', self.product_writer.count)
+        eta = self.eta_seconds()
+        if eta is not None:
+            metrics.set_gauge('eta_seconds', round(eta, 1))
+
+    def report_stage_stats(self, elapsed: float):
+        for stats in self.stage_stats.values():
+            logger.info("  %s", stats.report(elapsed))
+
+    def _checkpoint(self, scraped: int, started: float):
+        logger.info("Saving progress... (%d products scraped so far, %d ingredients processed)", scraped, self._ingredients_done)
+        self.save_progress()
+        self.report_stage_stats(time.monotonic() - started)
+        eta = self.eta_seconds()
+        if eta is not None:
+            logger.info("ETA: %s remaining", time.strftime('%H:%M:%S', time.gmtime(eta)))
 
+    def scrape_all_products(self) -> int:
+        """Crawl the catalogue, streaming products to the JSONL output. Returns the number written.
+
+        Pipeline: brand listings and product pages are fetched on a thread pool,
+        pages are parsed on a process pool, and validation, scoring and output
+        run on this thread. Stages are chained through bounded in-order windows,
+        so memory stays flat and output order matches a serial crawl.
+        """
+        scraped = 0
+        # After a failed brand listing, resume must list its page again to retry it.
+        listing_gap = False
+        self.product_writer.open()
+        started = self._crawl_started = time.monotonic()
+        self._ingredients_done = 0
+        window = self.max_concurrency * 2
+        self.stage_stats = {
+            'listing': StageStats('listing', self.max_concurrency),
+            'fetch': StageStats('fetch', self.max_concurrency),
+            'parse': StageStats('parse', self.parse_workers),
+            'write': StageStats('write', 1),
+        }
+
+        parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers) if self.parse_workers > 0 else nullcontext()
         try:
-            name_elem = soup.find('h1')
-            if name_elem:
-                product_data['brandName'] = normalize(name_elem.text)
-
-            # --- NEW LOGIC: Extract manufacturer and country from <h1> and next <p> ---
-            for h1 in soup.find_all("h1", class_="p-1 bg-gray-200 text-left"):
-                label = h1.get_text(strip=True).lower()
-                value_tag = h1.find_next_sibling("p")
-                value = value_tag.get_text(strip=True) if value_tag else ""
-                if "manufacturer name" in label:
-                    product_data['manufacturer'] = value
-                elif "manufacturer country" in label:
-                    product_data['countryOfOrigin'] = value
-                elif "nrn" in label or "registration number" in label:
-                    product_data['nafdacNumber'] = value
-                elif "packsize" in label or "pack size" in label:
-                    product_data['packSize'] = value
-                elif "strength" in label:
-                    product_data['strength'] = value
-                elif "dosage form" in label:
-                    product_data['dosageForm'] = value
-                elif "marketing category" in label:
-                    category = value.lower()
-                    product_data['type'] = 'otc' if 'otc' in category else 'prescription'
-
-            # --- END NEW LOGIC ---
-
-            # Existing fallback logic for other fields (if needed)
-            detail_sections = soup.find_all('div', class_='detail-section')
-            for section in detail_sections:
-                title_tag = section.find('h3')
-                if not title_tag:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as fetch_pool, parse_pool as parse_executor:
+                logger.info("Fetching active ingredients...")
+                ingredients = self.iter_active_ingredients(fetch_pool)
+                jobs = self._iter_brand_jobs(fetch_pool, ingredients)
+                fetched = self._ordered_map(lambda job: self._submit_fetch(fetch_pool, job), jobs, window,
+                                            stats=self.stage_stats['fetch'])
+                parsed = self._ordered_map(lambda item: self._submit_parse(parse_executor, item), fetched,
+                                           max(window, self.parse_workers * 2), stats=self.stage_stats['parse'])
+                for ((idx, ingredient, brand, is_last), fetch_result), parse_result in parsed:
+                    write_started = time.perf_counter()
+                    if brand is not None:
+                        product_details = None
+                        if parse_result:
+                            product_details, parse_seconds, parse_error = parse_result
+                            if parse_error:
+                                logger.warning("Error parsing product details for ID %s: %s", brand['id'], parse_error)
+                            elif parse_seconds is not None:
+                                self.stage_stats['parse'].record(parse_seconds)
+                                self.metrics.observe('parse_seconds', parse_seconds)
+                                self._log_product_details(product_details)
+                                if self.response_cache:
+                                    self.response_cache.store_parsed(fetch_result.url, product_details)
+                        if product_details:
+                            self._merge_brand_fields(product_details, ingredient, brand)
+                            product_details['qualityScore'] = self._record_validation(brand['id'], product_details)
+                            product_details['fingerprint'] = product_fingerprint(product_details)
+                            self.product_writer.write(product_details)
+                            scraped += 1
+                            state = CheckpointStore.DONE
+                        else:
+                            logger.warning("Failed to scrape brand %s (ID: %s)", brand['name'], brand['id'])
+                            state = CheckpointStore.FAILED
+                        self.checkpoints.mark(CheckpointStore.PRODUCT, brand['id'], state, parent_id=ingredient['id'],
+                                              payload=dict(brand, genericName=ingredient['name']))
+                        self.metrics.inc('products_total', state=state)
+                        write_seconds = time.perf_counter() - write_started
+                        self.stage_stats['write'].record(write_seconds)
+                        self.metrics.observe('write_seconds', write_seconds)
+
+                    if not is_last:
+                        continue
+
+                    # Mark ingredient as processed after all its brands; a failed listing is retried on resume.
+                    self.checkpoints.mark(CheckpointStore.INGREDIENT, ingredient['id'],
+                                          CheckpointStore.FAILED if ingredient.get('listing_failed') else CheckpointStore.DONE,
+                                          payload={'name': ingredient['name']})
+                    self._ingredients_done = idx + 1
+                    listing_gap = listing_gap or ingredient.get('listing_failed', False)
+                    if ingredient['last_on_page'] and not listing_gap:
+                        # Every ingredient up to the end of this listing page is processed.
+                        self.current_progress['last_saved_page'] = ingredient['page']
+
+                    if (idx + 1) % 10 == 0: # Save every 10 ingredients
+                        self._checkpoint(scraped, started)
+                logger.info("Found %d active ingredients", self._ingredients_total)
+                self._checkpoint(scraped, started)
+        finally:
+            self.product_writer.close()
+
+        return scraped
+
+    def reparse_archive(self, chunk_size: int = 256) -> int:
+        """Re-run extraction over the page archive and rewrite the product stream. Returns products reparsed.
+
+        Products in the current output are reparsed from their latest archived
+        page (keeping their dateAdded) or kept as they are if it isn't archived;
+        failed products that have an archived page are retried. Brand listing
+        fields come from the checkpoint store, as in a crawl. Pages are parsed
+        in chunks on the process pool; no request is sent. Parsed records in
+        the response cache are cleared, so the next crawl parses unchanged
+        pages again instead of writing back the old extraction.
+        """
+        archive = self.page_archive
+        backend = self.parser.name
+        failed_ids = list(self.checkpoints.ids(CheckpointStore.PRODUCT, CheckpointStore.FAILED))
+        logger.info("Reparsing %d archived product pages", archive.product_count())
+        self.product_columns = ProductColumns()
+
+        def chunks() -> Iterator[List[Tuple[str, Optional[Dict]]]]:
+            chunk = []
+            seen = set()
+            for product in self.product_writer.iter_products():
+                seen.add(product['id'])
+                chunk.append((product['id'], product))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            for product_id in failed_ids:
+                if product_id in seen:
                     continue
-                title_text_original_normalized = normalize(title_tag.text) 
-                title_text_lower = title_text_original_normalized.lower()
-                value_text = ''
-                detail_value_div = section.find('div', class_='detail-value')
-                if detail_value_div:
-                    value_text = normalize(detail_value_div.text)
-                if not value_text:
-                    potential_texts = []
-                    for s in title_tag.find_next_siblings():
-                        if isinstance(s, str):
-                            norm_s = normalize(s)
-                            if norm_s:
-                                potential_texts.append(norm_s)
-                                break 
-                        elif s.name and s.name in ['p', 'span', 'div']:
-                            norm_s = normalize(s.text)
-                            if norm_s:
-                                potential_texts.append(norm_s)
-                                break 
-                    if potential_texts:
-                        value_text = potential_texts[0]
-                    else:
-                        stripped_texts_in_section = [normalize(t) for t in section.stripped_strings if normalize(t)]
-                        try:
-                            title_index = -1
-                            for i, st in enumerate(stripped_texts_in_section):
-                                if st.lower() == title_text_lower:
-                                    title_index = i
-                                    break
-                            if title_index != -1 and title_index + 1 < len(stripped_texts_in_section):
-                                value_text = stripped_texts_in_section[title_index + 1]
-                        except ValueError:
-                            pass
-                if not value_text and ':' in title_text_original_normalized:
-                    parts = title_text_original_normalized.split(':', 1)
-                    if len(parts) > 1 and normalize(parts[1].strip()):
-                        if any(keyword in title_text_lower for keyword in ['manufacturer name', 'company name', 'nrn', 'registration number', 'strength', 'dosage form', 'manufacturer country', 'country of origin', 'packsize']):
-                            value_text = normalize(parts[1].strip())
-                if any(x in title_text_lower for x in ['manufacturer name', 'company name', 'producer', 'produced by', 'manufactured by']):
-                    if not product_data['manufacturer']:
-                        product_data['manufacturer'] = value_text
-                elif any(x in title_text_lower for x in ['nrn', 'registration number', 'reg. no', 'reg no', 'nafdac reg']):
-                    if not product_data['nafdacNumber']:
-                        product_data['nafdacNumber'] = value_text
-                elif 'strength' in title_text_lower:
-                    if not product_data['strength']:
-                        product_data['strength'] = value_text
-                elif 'dosage form' in title_text_lower:
-                    if not product_data['dosageForm']:
-                        product_data['dosageForm'] = value_text
-                elif 'marketing category' in title_text_lower:
-                    category = value_text.lower()
-                    product_data['type'] = 'otc' if 'otc' in category else 'prescription'
-                elif any(x in title_text_lower for x in ['manufacturer country', 'country of origin', 'country of manufacture', 'made in']):
-                    if value_text and not product_data['countryOfOrigin']:
-                        product_data['countryOfOrigin'] = value_text
-                elif 'packsize' in title_text_lower or 'pack size' in title_text_lower:
-                    if not product_data['packSize']:
-                        product_data['packSize'] = value_text
-
-            # Fallback for manufacturer if still not found by section parsing
-            if not product_data['manufacturer']:
-                brand_name = product_data['brandName']
-                manufacturer_patterns = [
-                    r'^([A-Z][A-Za-z\s.,\'&-]+)(?=\s+\d)',
-                    r'^([A-Z][A-Za-z\s.,\'&-]+)(?=\s+(?:Tablet|Capsule|Suspension|Syrup|Injection|Cream|Ointment|Gel|Powder|Solution|Drops|Spray|Inhaler|Patch|Suppository|Enema|Aerosol))',
-                    r'^([A-Z][A-Za-z\s.,\'&-]+)(?=\s+(?:mg|g|ml|IU|mcg|µg|%|w/v|w/w))',
-                    r'^([A-Z][A-Za-z\s.,\'&-]+)(?=\s+(?:Plus|Extra|Forte|SR|XR|CR|MR|LA|DS))'
-                ]
-                for pattern in manufacturer_patterns:
-                    manufacturer_match = re.search(pattern, brand_name)
-                    if manufacturer_match:
-                        potential_manufacturer = manufacturer_match.group(1).strip()
-                        if len(potential_manufacturer) > 3 and (' ' in potential_manufacturer or potential_manufacturer.endswith(('.', 'Ltd', 'Inc', 'PLC'))):
-                            product_data['manufacturer'] = potential_manufacturer
-                            break
-            if not product_data['strength'] or not product_data['dosageForm']:
-                brand_name = product_data['brandName']
-                strength_pattern = r'(\d+(?:\.\d+)?\s*(?:mg|g|ml|IU|mcg|µg|%|w/v|w/w)(?:\s*/\s*\d*\.?\d*\s*(?:ml|dose|actuation))?)'
-                dosage_form_pattern = r'(tablet|capsule|suspension|syrup|injection|cream|ointment|gel|powder|solution|drops|spray|inhaler|patch|suppository|enema|aerosol|lozenge|granules|effervescent|oral liquid|oral solution|oral suspension|oral drops|oral powder|for injection|for solution|for suspension)'
-                if not product_data['strength']:
-                    strength_match = re.search(strength_pattern, brand_name, re.IGNORECASE)
-                    if strength_match:
-                        product_data['strength'] = strength_match.group(1)
-                if not product_data['dosageForm']:
-                    dosage_match = re.search(dosage_form_pattern, brand_name, re.IGNORECASE)
-                    if dosage_match:
-                        product_data['dosageForm'] = dosage_match.group(1).capitalize()
-
-            print(f"\nProduct {product_id} details:")
-            print(f"Brand Name: {product_data['brandName']}")
-            print(f"Manufacturer: {product_data['manufacturer']}")
-            print(f"NAFDAC Number: {product_data['nafdacNumber']}")
-            print(f"Country: {product_data['countryOfOrigin']}")
-            print(f"Strength: {product_data['strength']}")
-            print(f"Dosage Form: {product_data['dosageForm']}")
+                chunk.append((product_id, None))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
 
+        def submit(executor, chunk) -> Future:
+            pages = []
+            for product_id, _ in chunk:
+                location = archive.locate_product(product_id)
+                if location:
+                    pages.append((product_id, *location))
+            if executor is None:
+                return completed_future(parse_archived_pages(backend, pages))
+            return executor.submit(parse_archived_pages, backend, pages)
+
+        reparsed = kept = 0
+        started = time.perf_counter()
+        output = ProductStreamWriter(f"{self.product_writer.path}.reparse")
+        output.reset()
+        output.open()
+        parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers) if self.parse_workers > 0 else nullcontext()
+        try:
+            with parse_pool as executor:
+                for chunk, results in self._ordered_map(lambda chunk: submit(executor, chunk), chunks(),
+                                                        window=max(2, self.parse_workers * 2)):
+                    parsed = {product_id: (record, error) for product_id, record, error in results}
+                    for product_id, previous in chunk:
+                        record, error = parsed.get(product_id, (None, None))
+                        if error:
+                            logger.warning("Error parsing archived page for ID %s: %s", product_id, error)
+                        if record:
+                            brand = self.checkpoints.payload(CheckpointStore.PRODUCT, product_id) or {}
+                            generic_name = brand.get('genericName') or (previous or {}).get('genericName', '')
+                            if previous and previous.get('dateAdded'):
+                                record['dateAdded'] = previous['dateAdded']
+                            self._merge_brand_fields(record, {'name': generic_name},
+                                                     {'strength': brand.get('strength', ''),
+                                                      'dosageForm': brand.get('dosageForm', '')})
+                            record['qualityScore'] = self._record_validation(product_id, record)
+                            record['fingerprint'] = product_fingerprint(record)
+                            output.write(record)
+                            reparsed += 1
+                            if previous is None:
+                                self.checkpoints.mark(CheckpointStore.PRODUCT, product_id, CheckpointStore.DONE)
+                        elif previous:
+                            self._record_validation(product_id, previous)
+                            output.write(previous)
+                            kept += 1
+        except BaseException:
+            output.close()
+            os.remove(output.path)
+            raise
+        output.close()
+        os.replace(output.path, self.product_writer.path)
+        self.product_writer.count = output.count
+        if self.response_cache:
+            # Records cached by the previous extraction would otherwise be reused for unchanged pages.
+            cleared = self.response_cache.clear_parsed('%/products/details/%')
+            logger.info("Cleared %d cached parsed records", cleared)
+        elapsed = time.perf_counter() - started
+        logger.info("Reparsed %d products (%d kept without an archived page) in %.1fs, %.0f pages/s",
+                    reparsed, kept, elapsed, reparsed / elapsed if elapsed else 0.0)
+        return reparsed
+
+    def output_ids(self) -> set:
+        """IDs in the finalized nafdac_products.json, if there is one."""
+        if not os.path.exists(self.products_file):
+            return set()
+        with open(self.products_file, 'r', encoding='utf-8') as f:
+            return {product['id'] for product in json.load(f)}
+
+    def seed_stream_from_output(self) -> int:
+        """Rebuild the JSONL stream from nafdac_products.json when the stream is missing or older.
+
+        Runs that rewrite the stream and finalize it (--recover, --reparse) would
+        otherwise replace a legacy or newer nafdac_products.json with whatever
+        the stream holds. Returns the number of products seeded.
+        """
+        stream = self.product_writer.path
+        if not os.path.exists(self.products_file):
+            return 0
+        if os.path.exists(stream) and os.path.getsize(stream) and \
+                os.path.getmtime(stream) >= os.path.getmtime(self.products_file):
+            return 0
+        with open(self.products_file, 'r', encoding='utf-8') as f:
+            products = json.load(f)
+        output = ProductStreamWriter(f"{stream}.seed")
+        output.reset()
+        output.open()
+        for product in products:
+            output.write(product)
+        output.close()
+        os.replace(output.path, stream)
+        self.product_writer.count = output.count
+        logger.info("Seeded %s with %d products from %s", stream, output.count, self.products_file)
+        return output.count
+
+    def recovery_targets(self, incomplete: bool = False) -> List[str]:
+        """IDs of failed products and, with `incomplete`, of written products missing a validated field.
+
+        Incomplete products come from the product columns and from the
+        missing_* lists of validation_log.json. The log is only trusted when it
+        has a 'summary' section: older logs were built before brand listing
+        fields were merged in and flag most of the catalogue.
+        """
+        targets = dict.fromkeys(self.checkpoints.ids(CheckpointStore.PRODUCT, CheckpointStore.FAILED))
+        if not incomplete:
+            return list(targets)
+        for field in VALIDATION_LOG_FIELDS.values():
+            targets.update(dict.fromkeys(self.product_columns.missing_ids(field)))
+        if os.path.exists(self.validation_log_file):
+            with open(self.validation_log_file, 'r', encoding='utf-8') as f:
+                validation_log = json.load(f)
+            if 'summary' in validation_log:
+                for key in VALIDATION_LOG_FIELDS:
+                    targets.update(dict.fromkeys(str(product_id) for product_id in validation_log.get(key, [])))
+        return list(targets)
+
+    def _recover_product(self, product_id: str, retry_policy: RetryPolicy) -> Optional[Dict]:
+        """Fetch a fresh copy of a product page (bypassing the response cache) and parse it."""
+        url = f"{self.base_url}/products/details/{product_id}"
+        result = self.fetch(url, retry_key=product_id, retry_policy=retry_policy, conditional=False)
+        if not result:
+            return None
+        try:
+            product_data = self.parser.parse(product_id, result.text)
         except Exception as e:
-            print(f"[WARN] Error parsing product details for ID {product_id}: {e}")
+            logger.warning("Error parsing product details for ID %s: %s", product_id, e)
             return None
-
+        if self.response_cache:
+            self.response_cache.store_parsed(url, product_data)
         return product_data
 
-    def scrape_all_products(self):
-        all_products = []
-        
-        print("Fetching active ingredients...")
-        ingredients = self.get_active_ingredients()
-        print(f"Found {len(ingredients)} active ingredients")
-        total_ingredients = len(ingredients)
-
-        for idx, ingredient in enumerate(ingredients):
-            # Skip if already processed (if implementing resume logic for ingredients)
-            # if ingredient['id'] in self.current_progress['processed_ingredients']:
-            #     print(f"\n[{idx+1}/{total_ingredients}] Skipping already processed ingredient: {ingredient['name']} (ID: {ingredient['id']})")
-            #     continue
-
-            print(f"\n[{idx+1}/{total_ingredients}] Processing ingredient: {ingredient['name']} (ID: {ingredient['id']})")
-            brands = self.get_brands_for_ingredient(ingredient['id'])
-            print(f"Found {len(brands)} brands for {ingredient['name']}")
+    def recover_products(self, product_ids: Optional[List[str]] = None, retry_policy: Optional[RetryPolicy] = None,
+                         incomplete: bool = False) -> Tuple[int, int]:
+        """Re-fetch only the given products (default: `recovery_targets(incomplete)`) and merge them into the output.
 
-            for bidx, brand in enumerate(brands):
-                 # Skip if already processed (if implementing resume logic for brands)
-                # if brand['id'] in self.current_progress['processed_brands']:
-                #     print(f"  - [{bidx+1}/{len(brands)}] Skipping already processed brand: {brand['name']} (ID: {brand['id']})")
-                #     continue
+        Pages are fetched concurrently under `retry_policy`. A recovered record
+        replaces the product in place in the stream, keeping its dateAdded and
+        any field the fresh page left empty; recovered failed products are
+        appended and marked done. Returns (recovered, still failing).
+        """
+        product_ids = self.recovery_targets(incomplete) if product_ids is None else list(dict.fromkeys(product_ids))
+        if not product_ids:
+            logger.info("Nothing to recover")
+            return 0, 0
+        policy = retry_policy or self.retry_policy
+        logger.info("Recovering %d products", len(product_ids))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            futures = {executor.submit(self._recover_product, product_id, policy): product_id
+                       for product_id in product_ids}
+            fetched = {futures[future]: future.result() for future in as_completed(futures)}
 
-                print(f"  - [{bidx+1}/{len(brands)}] Fetching details for brand: {brand['name']} (ID: {brand['id']})")
-                product_details = self.get_product_details(brand['id'])
+        recovered: Dict[str, Dict] = {}
+        for product_id in product_ids:
+            record = fetched[product_id]
+            if not record:
+                logger.warning("Could not recover product %s", product_id)
+                continue
+            brand = self.checkpoints.payload(CheckpointStore.PRODUCT, product_id) or {}
+            self._merge_brand_fields(record, {'name': brand.get('genericName', '')},
+                                     {'strength': brand.get('strength', ''), 'dosageForm': brand.get('dosageForm', '')})
+            recovered[product_id] = record
+
+        # Rewrite the stream so recovered products keep their position.
+        self.product_columns = ProductColumns()
+        output = ProductStreamWriter(f"{self.product_writer.path}.recover")
+        output.reset()
+        output.open()
+        try:
+            for product in self.product_writer.iter_products():
+                record = recovered.pop(product['id'], None)
+                if record:
+                    for field, value in product.items():
+                        if field not in VOLATILE_FIELDS and value and not record.get(field):
+                            record[field] = value
+                    record['dateAdded'] = product.get('dateAdded') or record.get('dateAdded')
+                    record['qualityScore'] = self._record_validation(product['id'], record)
+                    record['fingerprint'] = product_fingerprint(record)
+                    product = record
+                else:
+                    self._record_validation(product['id'], product)
+                output.write(product)
+            for product_id, record in recovered.items():
+                record['qualityScore'] = self._record_validation(product_id, record)
+                record['fingerprint'] = product_fingerprint(record)
+                output.write(record)
+        except BaseException:
+            output.close()
+            os.remove(output.path)
+            raise
+        output.close()
+        os.replace(output.path, self.product_writer.path)
+        self.product_writer.count = output.count
+        failed = set(self.checkpoints.ids(CheckpointStore.PRODUCT, CheckpointStore.FAILED))
+        done = [product_id for product_id in product_ids if fetched[product_id]]
+        for product_id in product_ids:
+            if fetched[product_id]:
+                self.checkpoints.mark(CheckpointStore.PRODUCT, product_id, CheckpointStore.DONE)
+            elif product_id in failed:
+                self.checkpoints.mark(CheckpointStore.PRODUCT, product_id, CheckpointStore.FAILED)
+        logger.info("Recovered %d of %d products in %.1fs", len(done), len(product_ids), time.perf_counter() - started)
+        return len(done), len(product_ids) - len(done)
+
+    # --- Sharded crawl: one coordinator, any number of workers sharing a WorkQueue ---
+
+    def _run_task(self, queue: WorkQueue, owner: str, kind: str, item_id: str, payload: Optional[Dict]):
+        """Worker side of one leased task: list an ingredient's brands, or fetch and parse a product."""
+        started = time.perf_counter()
+        if kind == WorkQueue.INGREDIENT:
+            content = self.get_page(f"{self.base_url}/ingredient/products/{item_id}")
+            if content is None:
+                queue.complete(kind, item_id, owner, WorkQueue.FAILED)
+            else:
+                brands = self.parse_brand_listing(content)
+                children = [(WorkQueue.PRODUCT, brand['id'], dict(brand, genericName=payload['name']))
+                            for brand in brands]
+                queue.complete(kind, item_id, owner, WorkQueue.DONE, {'brands': len(brands)}, children)
+            self.stage_stats['listing'].record(time.perf_counter() - started)
+            return
+        record = self._scrape_product_details(item_id)
+        result = {'record': record}
+        if item_id in self.validation_log['retry_attempts']:
+            result['retry_attempts'] = self.validation_log['retry_attempts'].pop(item_id)
+        queue.complete(kind, item_id, owner, WorkQueue.DONE if record else WorkQueue.FAILED, result)
+        self.stage_stats['fetch'].record(time.perf_counter() - started)
+
+    def run_worker(self, queue: WorkQueue, owner: str, poll_interval: float = 1.0) -> int:
+        """Lease and run tasks until the coordinator's crawl is finished. Returns the number of tasks run.
+
+        Up to `max_concurrency * 2` tasks are leased at a time and topped up as
+        they complete, so the fetch pool stays busy. A worker that finds the
+        queue finished by an earlier generation waits for the coordinator to
+        start the next one.
+        """
+        self.stage_stats = {
+            'listing': StageStats('listing', self.max_concurrency),
+            'fetch': StageStats('fetch', self.max_concurrency),
+        }
+        started = time.monotonic()
+        completed = 0
+        in_flight = set()
+        joined = queue.generation()
+        running = waiting = False
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            while True:
+                room = self.max_concurrency * 2 - len(in_flight)
+                for kind, item_id, _, payload in (queue.lease(owner, room) if room > 0 else []):
+                    in_flight.add(pool.submit(self._run_task, queue, owner, kind, item_id, payload))
+                    running = True
+                if not in_flight:
+                    if not queue.finished():
+                        running = True
+                    elif running or queue.generation() != joined:
+                        break
+                    elif not waiting:
+                        logger.info("Worker %s: the queue holds a finished crawl, waiting for the coordinator", owner)
+                        waiting = True
+                    time.sleep(poll_interval)
+                    continue
+                done, in_flight = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                    completed += 1
+                    if completed % 100 == 0:
+                        logger.info("Worker %s: %d tasks done", owner, completed)
+                        self.report_stage_stats(time.monotonic() - started)
+        logger.info("Worker %s finished after %d tasks", owner, completed)
+        return completed
+
+    def coordinate(self, queue: WorkQueue, poll_interval: float = 5.0, idle_timeout: float = 600.0) -> int:
+        """Enqueue the catalogue's ingredients, wait for the workers, then merge their results.
+
+        Ingredients already processed according to the checkpoint store are not
+        enqueued again. Returns the number of products merged into the output.
+        Raises RuntimeError when no task completes for `idle_timeout` seconds
+        (no worker running); finished results stay in the queue for a resumed run.
+        """
+        generation = queue.start_generation()
+        logger.info("Starting crawl generation %d", generation)
+        seq = queue.next_seq()
+        last_page = self.current_progress['last_saved_page']
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            logger.info("Enqueueing active ingredients...")
+            for ingredient in self.iter_active_ingredients(pool):
+                last_page = ingredient['page']
+                if self.checkpoints.is_done(CheckpointStore.INGREDIENT, ingredient['id']):
+                    continue
+                queue.add(WorkQueue.INGREDIENT, ingredient['id'], seq, {'name': ingredient['name']})
+                seq += 1
+        queue.set_meta('discovery_done', True)
+        logger.info("Enqueued %d active ingredients, waiting for workers", self._ingredients_total)
+
+        settled, idle_since = None, time.monotonic()
+        while not queue.finished():
+            counts = queue.counts()
+            logger.info("Work queue: %d pending, %d leased, %d done, %d failed",
+                        counts.get(WorkQueue.PENDING, 0), counts.get(WorkQueue.LEASED, 0),
+                        counts.get(WorkQueue.DONE, 0), counts.get(WorkQueue.FAILED, 0))
+            if counts.get(WorkQueue.DONE, 0) + counts.get(WorkQueue.FAILED, 0) != settled:
+                settled, idle_since = counts.get(WorkQueue.DONE, 0) + counts.get(WorkQueue.FAILED, 0), time.monotonic()
+            idle = time.monotonic() - idle_since
+            if idle >= idle_timeout:
+                raise RuntimeError(f"No work queue task completed for {idle:.0f}s; start workers with --worker "
+                                   f"and resume the coordinator")
+            if idle >= queue.lease_seconds:
+                logger.warning("No work queue task completed for %.0fs, are workers running?", idle)
+            time.sleep(poll_interval)
+
+        merged = self.merge_shards(queue)
+        self.current_progress['last_saved_page'] = last_page
+        self.save_progress()
+        return merged
+
+    def merge_shards(self, queue: WorkQueue) -> int:
+        """Fold worker results into the product stream, checkpoints and validation log.
+
+        Results are merged in (ingredient, brand) order, so the output is the
+        same however the work was spread. Products already in the checkpoint
+        store are skipped, which makes an interrupted merge safe to rerun.
+        """
+        merged = 0
+        self.product_writer.open()
+        try:
+            for product_id, state, ingredient_id, brand, result in queue.results(WorkQueue.PRODUCT):
+                if self.checkpoints.is_done(CheckpointStore.PRODUCT, product_id):
+                    continue
+                if result and 'retry_attempts' in result:
+                    self.validation_log['retry_attempts'][product_id] = result['retry_attempts']
+                product_details = result.get('record') if result and state == WorkQueue.DONE else None
                 if product_details:
-                    product_details['genericName'] = ingredient['name']
-                    if brand['strength'] and not product_details['strength']: # Prioritize section-parsed, then brand list
-                        product_details['strength'] = brand['strength']
-                    if brand['dosageForm'] and not product_details['dosageForm']: # Prioritize section-parsed, then brand list
-                        product_details['dosageForm'] = brand['dosageForm']
-                    all_products.append(product_details)
-                    self.current_progress['processed_brands'].append(brand['id']) # Mark brand as processed
+                    self._merge_brand_fields(product_details, {'name': brand['genericName']}, brand)
+                    product_details['qualityScore'] = self._record_validation(product_id, product_details)
+                    product_details['fingerprint'] = product_fingerprint(product_details)
+                    self.product_writer.write(product_details)
+                    merged += 1
+                    state = CheckpointStore.DONE
                 else:
-                    print(f"    [WARN] Failed to scrape brand {brand['name']} (ID: {brand['id']})")
-                    self.current_progress['failed_scrapes'].append(brand['id'])
-            
-            self.current_progress['processed_ingredients'].append(ingredient['id']) # Mark ingredient as processed after all its brands
+                    logger.warning("Failed to scrape brand %s (ID: %s)", brand['name'], product_id)
+                    state = CheckpointStore.FAILED
+                self.checkpoints.mark(CheckpointStore.PRODUCT, product_id, state, parent_id=ingredient_id, payload=brand)
+                self.metrics.inc('products_total', state=state)
+            for ingredient_id, state, _, ingredient, _ in queue.results(WorkQueue.INGREDIENT):
+                if state == WorkQueue.DONE:
+                    self.checkpoints.mark(CheckpointStore.INGREDIENT, ingredient_id, CheckpointStore.DONE, payload=ingredient)
+                    self._ingredients_done += 1
+                elif state == WorkQueue.FAILED:
+                    self.checkpoints.mark(CheckpointStore.INGREDIENT, ingredient_id, CheckpointStore.FAILED, payload=ingredient)
+        finally:
+            self.product_writer.close()
+        logger.info("Merged %d products from the work queue", merged)
+        return merged
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Scrape the NAFDAC Greenbook product catalogue.")
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help="Maximum number of requests in flight overall (default: 8)")
+    parser.add_argument('--per-host-concurrency', type=int, default=4,
+                        help="Maximum number of requests in flight per host (default: 4)")
+    parser.add_argument('--max-attempts', type=int, default=4,
+                        help="Maximum attempts per request, including the first (default: 4)")
+    parser.add_argument('--retry-budget', type=float, default=60.0,
+                        help="Maximum seconds spent on one request across all attempts (default: 60)")
+    parser.add_argument('--rate', type=float, default=2.0,
+                        help="Initial requests per second per host (default: 2)")
+    parser.add_argument('--min-rate', type=float, default=0.2,
+                        help="Lowest request rate the limiter backs off to (default: 0.2)")
+    parser.add_argument('--max-rate', type=float, default=20.0,
+                        help="Highest request rate the limiter ramps up to (default: 20)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Disable the conditional-request response cache")
+    parser.add_argument('--cache-file', default='http_cache.db',
+                        help="Response cache location (default: http_cache.db)")
+    parser.add_argument('--cache-max-mb', type=int, default=512,
+                        help="Evict least recently used cache entries beyond this size (default: 512)")
+    parser.add_argument('--cache-max-age-days', type=float, default=30,
+                        help="Drop cache entries not revalidated for this many days (default: 30)")
+    parser.add_argument('--parser', choices=sorted(PARSER_BACKENDS), default=None,
+                        help="Product page parser backend (default: lxml if installed, else soup)")
+    parser.add_argument('--parse-workers', type=int, default=None,
+                        help="Parser processes; 0 parses on the main thread (default: CPU count)")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="Logging level; DEBUG adds per-product details (default: INFO)")
+    parser.add_argument('--metrics-file', default='scraper_metrics.json',
+                        help="Periodically written JSON metrics snapshot (default: scraper_metrics.json)")
+    parser.add_argument('--metrics-prom-file', default=None,
+                        help="Also write metrics in Prometheus text format to this file")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="Serve Prometheus metrics at http://0.0.0.0:PORT/metrics")
+    parser.add_argument('--metrics-interval', type=float, default=15.0,
+                        help="Seconds between metrics file writes (default: 15)")
+    parser.add_argument('--delta', action='store_true',
+                        help="Also write a change feed of added, modified and removed products since the "
+                             "previous delta run to nafdac_changes.jsonl")
+    parser.add_argument('--bulk-export', metavar='DIR',
+                        help="Write COPY-ready generic_drugs/branded_products CSV files to DIR "
+                             "(only the changed products with --delta)")
+    parser.add_argument('--load-postgres', metavar='DIR',
+                        help="Load a --bulk-export directory into Postgres (--database-url) and exit")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'),
+                        help="Postgres connection string for --load-postgres (default: $DATABASE_URL)")
+    parser.add_argument('--coordinator', action='store_true',
+                        help="Sharded crawl: enqueue ingredients in --queue-file, wait for workers and merge their results")
+    parser.add_argument('--worker', metavar='NAME',
+                        help="Sharded crawl: process tasks from --queue-file under this worker name until the crawl is done")
+    parser.add_argument('--spawn-workers', type=int, default=0,
+                        help="Workers the coordinator starts on this machine (default: 0, workers join with --worker)")
+    parser.add_argument('--queue-file', default='work_queue.db',
+                        help="Shared work queue for sharded crawls (default: work_queue.db)")
+    parser.add_argument('--lease-seconds', type=float, default=120.0,
+                        help="Seconds before a task leased by an unresponsive worker is handed out again (default: 120)")
+    parser.add_argument('--worker-timeout', type=float, default=600.0,
+                        help="Seconds the coordinator waits without any task completing before giving up (default: 600)")
+    parser.add_argument('--archive-dir', default='page_archive',
+                        help="Compressed archive of every fetched page (default: page_archive)")
+    parser.add_argument('--no-archive', action='store_true',
+                        help="Do not archive fetched pages")
+    parser.add_argument('--reparse', action='store_true',
+                        help="Re-run product extraction over the page archive on all cores, without network "
+                             "access, and rewrite the output")
+    parser.add_argument('--recover', nargs='*', metavar='ID',
+                        help="Re-fetch only failed products (or the given product IDs) and merge them into the "
+                             "existing output")
+    parser.add_argument('--recover-incomplete', action='store_true',
+                        help="With --recover, also re-fetch products missing a validated field")
+    parser.add_argument('--recover-max-attempts', type=int, default=8,
+                        help="Maximum attempts per request during --recover (default: 8)")
+    parser.add_argument('--recover-retry-budget', type=float, default=180.0,
+                        help="Maximum seconds spent on one request during --recover (default: 180)")
+    start = parser.add_mutually_exclusive_group()
+    start.add_argument('--resume', action='store_true',
+                       help="Resume from saved progress without prompting")
+    start.add_argument('--fresh', action='store_true',
+                       help="Discard saved progress and start over without prompting")
+    parser.add_argument('--search-index', metavar='DIR',
+                        help="Write the prebuilt product search index to DIR; with --delta an existing index is "
+                             "updated from the change feed")
+    parser.add_argument('--check-parser-parity', nargs='?', const='', metavar='DIR',
+                        help="Compare the parser backends on DIR/<product_id>.html fixtures "
+                             "(or on cached product pages if DIR is omitted) and exit")
+    return parser.parse_args(argv)
+
+
+def check_parser_parity(fixture_dir: str, cache_file: str) -> bool:
+    if fixture_dir:
+        pages = iter_fixture_pages(fixture_dir)
+    else:
+        cache = ResponseCache(cache_file)
+        pages = ((url.rsplit('/', 1)[-1], body) for url, body in cache.iter_bodies('%/products/details/%'))
+    compared, mismatches = compare_parsers(pages, SoupProductParser(), make_parser('lxml'))
+    for product_id, field, expected, actual in mismatches:
+        print(f"[MISMATCH] {product_id} {field}: soup={expected!r} lxml={actual!r}")
+    print(f"Compared {compared} pages: {len(mismatches)} field mismatches")
+    return compared > 0 and not mismatches
+
 
-            if (idx + 1) % 10 == 0 or (idx + 1) == total_ingredients : # Save every 10 ingredients or at the end
-                print(f"\nSaving progress... ({len(all_products)} products scraped so far, {idx+1} ingredients processed)")
-                self.save_progress(all_products) # Save all_products accumulated so far
+def build_scraper(args: argparse.Namespace) -> NAFDACScraper:
+    return NAFDACScraper(
+        max_concurrency=args.concurrency,
+        per_host_concurrency=args.per_host_concurrency,
+        retry_policy=RetryPolicy(max_attempts=args.max_attempts, max_elapsed=args.retry_budget),
+        initial_rate=args.rate,
+        min_rate=args.min_rate,
+        max_rate=args.max_rate,
+        response_cache=None if args.no_cache else ResponseCache(
+            args.cache_file, max_bytes=args.cache_max_mb * 1024 * 1024, max_age=args.cache_max_age_days * 86400),
+        parser_backend=args.parser,
+        parse_workers=args.parse_workers,
+        page_archive=None if args.no_archive else PageArchive(args.archive_dir),
+    )
 
-        return all_products
+
+def run_worker_process(args: argparse.Namespace, name: str):
+    """Entry point of a sharded-crawl worker (--worker, or spawned by --coordinator)."""
+    logging.basicConfig(level=getattr(logging, args.log_level), format=f'%(asctime)s %(levelname)s [{name}] %(message)s')
+    scraper = build_scraper(args)
+    queue = WorkQueue(args.queue_file, lease_seconds=args.lease_seconds)
+    try:
+        scraper.run_worker(queue, name)
+    finally:
+        queue.close()
 
 
 def main():
-    scraper = NAFDACScraper()
-    # Basic resume logic (can be expanded)
-    if os.path.exists(scraper.progress_file):
-        load_progress = input("Found existing progress file. Resume? (y/n): ").lower()
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level), format='%(asctime)s %(levelname)s %(message)s')
+    if args.check_parser_parity is not None:
+        raise SystemExit(0 if check_parser_parity(args.check_parser_parity, args.cache_file) else 1)
+    if args.load_postgres:
+        if not args.database_url:
+            raise SystemExit("--load-postgres needs --database-url or DATABASE_URL")
+        started = time.perf_counter()
+        loaded = load_bulk_export(args.load_postgres, args.database_url)
+        print(f"Loaded {loaded['generic_drugs']} new generic drugs, upserted {loaded['branded_products']} and deleted "
+              f"{loaded['branded_products_deleted']} branded products in {time.perf_counter() - started:.1f}s")
+        return
+    if args.worker:
+        run_worker_process(args, args.worker)
+        return
+    scraper = build_scraper(args)
+    queue = WorkQueue(args.queue_file, lease_seconds=args.lease_seconds) if args.coordinator else None
+    fresh = True
+    recover = args.recover is not None
+    expected_ids = set()
+    if args.reparse or recover:
+        if args.reparse and recover:
+            raise SystemExit("--reparse and --recover cannot be combined")
+        if args.reparse and scraper.page_archive is None:
+            raise SystemExit("--reparse needs the page archive (drop --no-archive)")
+        if recover and queue:
+            raise SystemExit("--recover cannot be combined with --coordinator")
+        # Both rewrite the stream and finalize it over nafdac_products.json: start from the latest output.
+        scraper.seed_stream_from_output()
+        expected_ids = scraper.output_ids()
+        scraper.load_progress()
+        fresh = False
+    elif not args.fresh and (scraper.checkpoints.has_state() or os.path.exists(scraper.progress_file)):
+        load_progress = 'y' if args.resume else input("Found existing progress. Resume? (y/n): ").lower()
         if load_progress == 'y':
             try:
-                with open(scraper.progress_file, 'r') as f:
-                    scraper.current_progress = json.load(f)
+                scraper.load_progress()
+                fresh = False
                 print(f"Resuming from page {scraper.current_progress.get('last_saved_page', 0) + 1}")
-                # Potentially load existing products if you want to append instead of restart product list
-                # if os.path.exists('nafdac_products.json'):
-                #     with open('nafdac_products.json', 'r', encoding='utf-8') as f:
-                #         # This would require `scrape_all_products` to be able to append
-                #         # For now, it restarts the product list but skips processed items
-                #         pass 
+                # New products are appended to the existing nafdac_products.jsonl stream
             except Exception as e:
-                print(f"Could not load progress file, starting fresh: {e}")
-                scraper.current_progress = scraper.get_initial_progress() # Reset on error
+                print(f"Could not load progress, starting fresh: {e}")
+                scraper.reset_progress() # Reset on error
         else:
             print("Starting fresh scrape...")
-            scraper.current_progress = scraper.get_initial_progress() # Reset progress
+            scraper.reset_progress()
     else:
         print("Starting fresh scrape...")
+        scraper.reset_progress()
+    if queue and fresh:
+        queue.reset()
+
+    snapshot = scraper.load_snapshot() if args.delta else None
 
-    products = scraper.scrape_all_products()
-    print(f"\nScraped {len(products)} products in total (this run).")
+    exporter = MetricsExporter(scraper.metrics, json_path=args.metrics_file, prometheus_path=args.metrics_prom_file,
+                               interval=args.metrics_interval, port=args.metrics_port)
+    exporter.start()
+    workers = [multiprocessing.Process(target=run_worker_process, args=(args, f"{socket.gethostname()}-{i + 1}"))
+               for i in range(args.spawn_workers if queue else 0)]
+    try:
+        for worker in workers:
+            worker.start()
+        if args.reparse:
+            scraped = scraper.reparse_archive()
+        elif recover:
+            scraped, unrecovered = scraper.recover_products(
+                args.recover or None,
+                RetryPolicy(max_attempts=args.recover_max_attempts, max_elapsed=args.recover_retry_budget),
+                incomplete=args.recover_incomplete)
+            print(f"\nRecovered {scraped} products, {unrecovered} could not be recovered.")
+        elif queue:
+            scraped = scraper.coordinate(queue, idle_timeout=args.worker_timeout)
+        else:
+            scraped = scraper.scrape_all_products()
+    except BaseException:
+        # Spawned workers would otherwise wait for a crawl that will not finish.
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        raise
+    finally:
+        exporter.stop()
+        for worker in workers:
+            worker.join()
+    print(f"\nScraped {scraped} products in total (this run).")
     
+    scraper.update_validation_log()
     print("\nValidation Summary:")
     print(f"Products missing manufacturer: {len(scraper.validation_log['missing_manufacturer'])}")
     print(f"Products missing NAFDAC number: {len(scraper.validation_log['missing_nafdac'])}")
     print(f"Products missing strength: {len(scraper.validation_log['missing_strength'])}")
     print(f"Products missing dosage form: {len(scraper.validation_log['missing_dosage_form'])}")
-    print(f"Total failed scrapes (could not retrieve details): {len(scraper.current_progress['failed_scrapes'])}")
+    print(f"Average quality score: {scraper.validation_log['summary']['average_quality_score']}")
+    print(f"Total failed scrapes (could not retrieve details): {scraper.checkpoints.count(CheckpointStore.PRODUCT, CheckpointStore.FAILED)}")
     
-    scraper.save_progress(products) # Final save with all products from this run
-    print("\nSaved to JSON files")
+    scraper.save_progress()
+    scraper.export_progress()
+    if expected_ids:
+        lost = expected_ids - {product['id'] for product in scraper.product_writer.iter_products()}
+        if lost:
+            raise SystemExit(f"Refusing to overwrite {scraper.products_file}: {len(lost)} of its products are "
+                             f"missing from {scraper.product_writer.path}")
+    total = scraper.finalize_output()
+    print(f"\nSaved {total} products to {scraper.products_file}")
+    if snapshot is not None:
+        counts = scraper.write_change_feed(snapshot)
+        print(f"Change feed: {counts['added']} added, {counts['modified']} modified, {counts['removed']} removed, "
+              f"{counts['unchanged']} unchanged, {counts['kept']} kept -> {scraper.changes_file}")
+    if args.bulk_export:
+        if snapshot is not None:
+            products = (change['record'] for change in iter_change_feed(
+                scraper.changes_file, (SnapshotIndex.ADDED, SnapshotIndex.MODIFIED)))
+            removed = (change['id'] for change in iter_change_feed(scraper.changes_file, (SnapshotIndex.REMOVED,)))
+        else:
+            products, removed = scraper.product_writer.iter_products(), ()
+        rows = write_bulk_export(products, args.bulk_export, removed)
+        print(f"Bulk export: {rows[BRANDED_PRODUCTS_CSV]} branded products, {rows[GENERIC_DRUGS_CSV]} generic drugs, "
+              f"{rows[REMOVED_PRODUCTS_CSV]} removals -> {args.bulk_export}")
+    if args.search_index:
+        index = SearchIndex(args.search_index)
+        if snapshot is not None and index.exists():
+            upserts = (change['record'] for change in iter_change_feed(
+                scraper.changes_file, (SnapshotIndex.ADDED, SnapshotIndex.MODIFIED)))
+            removed = [change['id'] for change in iter_change_feed(scraper.changes_file, (SnapshotIndex.REMOVED,))]
+            counts = index.apply(upserts, removed)
+        else:
+            counts = index.rebuild(scraper.product_writer.iter_products())
+        print(f"Search index: {counts['documents']} products, {counts['changed_documents']} changed, "
+              f"{counts['doc_shards']} document / {counts['term_shards']} term / {counts['trigram_shards']} "
+              f"trigram shards rewritten -> {args.search_index}")
+
 
 if __name__ == "__main__":
     main()
@@ -9,55 +9,96 @@ const supabaseUrl = process.env.NEXT_PUBLIC_SUPABASE_URL!;
 const supabaseKey = process.env.NEXT_PUBLIC_SUPABASE_ANON_KEY!;
 const supabase = createClient(supabaseUrl, supabaseKey);
 
+// Rows per upsert request; one request per row meant >12k round trips.
+const BATCH_SIZE = 1000;
+
+function chunk<T>(rows: T[], size: number): T[][] {
+  const batches: T[][] = [];
+  for (let i = 0; i < rows.length; i += size) {
+    batches.push(rows.slice(i, i + size));
+  }
+  return batches;
+}
+
+// One upsert statement cannot touch the same row twice, so keep the last row per id (as per-row upserts would).
+function uniqueById<T extends { id: string }>(rows: T[]): T[] {
+  const byId = new Map<string, T>();
+  for (const row of rows) {
+    byId.set(row.id, row);
+  }
+  return Array.from(byId.values());
+}
+
+// Upserts `rows` in batches; a failed batch is retried row by row so only the
+// rows that really fail are lost. Returns the ids of those rows.
+async function upsertInBatches<T extends { id: string }>(table: string, rows: T[]): Promise<Set<string>> {
+  const failed = new Set<string>();
+  for (const batch of chunk(uniqueById(rows), BATCH_SIZE)) {
+    const { error } = await supabase.from(table).upsert(batch);
+    if (!error) {
+      continue;
+    }
+    console.error(`Error importing ${table} ${batch[0].id}..${batch[batch.length - 1].id}, retrying row by row:`, error);
+    for (const row of batch) {
+      const { error: rowError } = await supabase.from(table).upsert(row);
+      if (rowError) {
+        console.error(`Error importing ${table} ${row.id}:`, rowError);
+        failed.add(row.id);
+      }
+    }
+  }
+  return failed;
+}
+
 async function importData() {
   try {
     console.log('Starting data import...');
 
-    // Import generic drugs
+    // Import generic drugs and branded products as multi-row upserts. For a
+    // full catalogue, `python scraper.py --bulk-export DIR` followed by
+    // `--load-postgres DIR` loads the same rows with COPY instead.
     console.log('Importing generic drugs...');
-    for (const drug of genericDrugs) {
-      const { error } = await supabase
-        .from('generic_drugs')
-        .upsert({
-          id: drug.id,
-          name: drug.name,
-          category: drug.category,
-          description: drug.description,
-          indication: drug.indication
-        });
+    const genericRows = genericDrugs.map((drug) => ({
+      id: drug.id,
+      name: drug.name,
+      category: drug.category,
+      description: drug.description,
+      indication: drug.indication
+    }));
+    const failedGenerics = await upsertInBatches('generic_drugs', genericRows);
 
-      if (error) {
-        console.error(`Error importing generic drug ${drug.name}:`, error);
+    console.log('Importing branded products...');
+    const brandRows = [];
+    let skippedBrands = 0;
+    for (const drug of genericDrugs) {
+      if (failedGenerics.has(drug.id)) {
+        skippedBrands += drug.brandProducts.length;
         continue;
       }
-
-      // Import branded products
       for (const brand of drug.brandProducts) {
-        const { error: brandError } = await supabase
-          .from('branded_products')
-          .upsert({
-            id: brand.id,
-            generic_id: drug.id,
-            brand_name: brand.brandName,
-            manufacturer: brand.manufacturer,
-            strength: brand.strength,
-            dosage_form: brand.dosageForm,
-            pack_size: brand.packSize,
-            verified: brand.verified,
-            rating: brand.rating,
-            image: brand.image,
-            bioequivalence: (typeof brand.bioequivalence === 'number') ? brand.bioequivalence : null,
-            nafdac_number: brand.nafdacNumber,
-            type: brand.type,
-            country_of_origin: brand.countryOfOrigin
-          });
-
-        if (brandError) {
-          console.error(`Error importing brand ${brand.brandName}:`, brandError);
-          continue;
-        }
+        brandRows.push({
+          id: brand.id,
+          generic_id: drug.id,
+          brand_name: brand.brandName,
+          manufacturer: brand.manufacturer,
+          strength: brand.strength,
+          dosage_form: brand.dosageForm,
+          pack_size: brand.packSize,
+          verified: brand.verified,
+          rating: brand.rating,
+          image: brand.image,
+          bioequivalence: (typeof brand.bioequivalence === 'number') ? brand.bioequivalence : null,
+          nafdac_number: brand.nafdacNumber,
+          type: brand.type,
+          country_of_origin: brand.countryOfOrigin
+        });
       }
     }
+    const failedBrands = await upsertInBatches('branded_products', brandRows);
+    if (failedGenerics.size || failedBrands.size) {
+      console.error(`Failed to import ${failedGenerics.size} generic drugs (skipping their ${skippedBrands} brands) ` +
+        `and ${failedBrands.size} branded products`);
+    }
 
     // Import suppliers
     console.log('Importing suppliers...');
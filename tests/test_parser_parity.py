@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+pytest.importorskip('lxml.html')
+
+import scraper  # noqa: E402
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'product_pages')
+
+
+def fixture_pages():
+    return list(scraper.iter_fixture_pages(FIXTURE_DIR))
+
+
+def test_lxml_parser_matches_soup_on_fixture_corpus():
+    compared, mismatches = scraper.compare_parsers(fixture_pages(), scraper.SoupProductParser(),
+                                                   scraper.LxmlProductParser())
+    assert compared == len(os.listdir(FIXTURE_DIR))
+    assert mismatches == []
+
+
+@pytest.mark.parametrize('backend', sorted(scraper.PARSER_BACKENDS))
+def test_fixture_corpus_covers_both_layouts(backend):
+    parser = scraper.PARSER_BACKENDS[backend]()
+    products = {product_id: parser.parse(product_id, content) for product_id, content in fixture_pages()}
+    # Labelled <h1> layout
+    assert products['1001']['manufacturer'] == 'Beecham Pharmaceuticals Ltd'
+    assert products['1001']['type'] == 'otc'
+    # detail-section layout, with empty siblings, comments, nested detail-value and text-node values
+    assert products['1002']['nafdacNumber'] == '04-1234'
+    assert products['1003']['manufacturer'] == 'Fidson Healthcare Plc'
+    assert products['1003']['nafdacNumber'] == 'A4-5678'
+    assert products['1004']['manufacturer'] == 'Novartis Pharma AG'
+    assert products['1004']['nafdacNumber'] == 'A4-9999'
+    assert products['1004']['dosageForm'] == 'Dispersible tablet'
+    # Both layouts on one page
+    assert products['1005']['strength'] == '1000 mg'
+    # Pages without product data
+    assert products['1007']['brandName'] == ''
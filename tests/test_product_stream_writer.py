@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+
+import scraper  # noqa: E402
+
+
+def test_open_truncates_partial_trailing_record(tmp_path):
+    path = tmp_path / 'nafdac_products.jsonl'
+    complete = [{'id': '1', 'brandName': 'Emzor Paracetamol'}, {'id': '2', 'brandName': 'Panadol'}]
+    # A crash in the middle of the third write.
+    path.write_text(''.join(json.dumps(product) + '\n' for product in complete) + '{"id": "3", "brandN',
+                    encoding='utf-8')
+
+    writer = scraper.ProductStreamWriter(str(path))
+    writer.open()
+    assert writer.count == 2
+    writer.write({'id': '3', 'brandName': 'Amoxil'})
+    writer.close()
+
+    assert [product['id'] for product in writer.iter_products()] == ['1', '2', '3']
+
+
+def test_open_keeps_complete_stream_and_later_records_win(tmp_path):
+    path = tmp_path / 'nafdac_products.jsonl'
+    writer = scraper.ProductStreamWriter(str(path))
+    writer.reset()
+    writer.open()
+    writer.write({'id': '1', 'strength': '500 mg'})
+    writer.write({'id': '2', 'strength': '250 mg'})
+    writer.close()
+    size = path.stat().st_size
+
+    writer.open()
+    assert path.stat().st_size == size
+    assert writer.count == 2
+    writer.write({'id': '1', 'strength': '1 g'})
+    writer.close()
+
+    assert list(writer.iter_products()) == [{'id': '2', 'strength': '250 mg'}, {'id': '1', 'strength': '1 g'}]
+    output_path = str(tmp_path / 'nafdac_products.json')
+    assert writer.finalize(output_path) == 2
+    with open(output_path, 'r', encoding='utf-8') as f:
+        assert json.load(f) == list(writer.iter_products())
@@ -0,0 +1,62 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+
+import scraper  # noqa: E402
+
+PRODUCTS = [
+    {'id': '101', 'brandName': 'Emzor Paracetamol', 'genericName': 'Paracetamol', 'manufacturer': 'Emzor Pharmaceutical',
+     'nafdacNumber': 'A4-1234', 'strength': '500 mg'},
+    {'id': '102', 'brandName': 'Panadol Extra', 'genericName': 'Paracetamol', 'manufacturer': 'GlaxoSmithKline',
+     'nafdacNumber': '04-5678', 'strength': '500 mg'},
+    {'id': '117', 'brandName': 'Amoxil', 'genericName': 'Amoxicillin', 'manufacturer': 'Beecham',
+     'nafdacNumber': 'A4-0001', 'strength': '250 mg'},
+    {'id': '133', 'brandName': 'Coartem', 'genericName': 'Artemether', 'manufacturer': 'Novartis',
+     'nafdacNumber': 'B4-7777', 'strength': '20 mg'},
+]
+
+
+def index_files(directory):
+    """Index files by name, parsed; manifest timestamps and empty shards are left out."""
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if name == 'manifest.json':
+            data.pop('generated_at')
+        if data and data != {'terms': [], 'postings': []}:
+            files[name] = data
+    return files
+
+
+def test_apply_produces_the_same_files_as_rebuild(tmp_path):
+    updated = dict(PRODUCTS[1], brandName='Panadol Advance', strength='1 g')
+    added = {'id': '150', 'brandName': 'Zinnat', 'genericName': 'Cefuroxime', 'manufacturer': 'GlaxoSmithKline',
+             'nafdacNumber': 'A4-2222', 'strength': '500 mg'}
+
+    incremental = scraper.SearchIndex(str(tmp_path / 'incremental'), doc_shards=4)
+    incremental.rebuild(PRODUCTS)
+    counts = incremental.apply([updated, added, PRODUCTS[2]], removed_ids=['133'])
+    assert counts['documents'] == 4
+    assert counts['changed_documents'] == 3
+
+    full = scraper.SearchIndex(str(tmp_path / 'full'), doc_shards=4)
+    full.rebuild([PRODUCTS[0], updated, PRODUCTS[2], added])
+
+    assert index_files(incremental.directory) == index_files(full.directory)
+
+
+def test_search_matches_prefixes_substrings_and_joined_fields(tmp_path):
+    index = scraper.SearchIndex(str(tmp_path / 'search_index'), doc_shards=4)
+    index.rebuild(PRODUCTS)
+
+    assert [doc['id'] for doc in index.search('paracetamol 500')] == ['101', '102']
+    assert [doc['id'] for doc in index.search('amox')] == ['117']
+    assert [doc['id'] for doc in index.search('artem')] == ['133']
+    assert [doc['id'] for doc in index.search('smith')] == ['102']
+    assert [doc['id'] for doc in index.search('a41234')] == ['101']
+    assert index.search('coartem 500') == []
@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+
+import scraper  # noqa: E402
+
+SnapshotIndex = scraper.SnapshotIndex
+OPS = (SnapshotIndex.ADDED, SnapshotIndex.MODIFIED, SnapshotIndex.REMOVED)
+
+PRODUCTS = [
+    {'id': '1', 'brandName': 'Emzor Paracetamol', 'strength': '500 mg'},
+    {'id': '2', 'brandName': 'Panadol', 'strength': '500 mg'},
+    {'id': '3', 'brandName': 'Amoxil', 'strength': '250 mg'},
+]
+
+
+def snapshot_of(products, path):
+    snapshot = SnapshotIndex(path)
+    snapshot.fingerprints = {product['id']: scraper.product_fingerprint(product) for product in products}
+    return snapshot
+
+
+def feed(path):
+    return [(change['op'], change['id']) for change in scraper.iter_change_feed(path, OPS)]
+
+
+def test_write_changes_reports_added_modified_and_removed(tmp_path):
+    snapshot = snapshot_of(PRODUCTS, str(tmp_path / 'snapshot.json'))
+    changes_path = str(tmp_path / 'changes.jsonl')
+    crawl = [PRODUCTS[0], dict(PRODUCTS[1], strength='1 g'), {'id': '4', 'brandName': 'Coartem'}]
+
+    counts = snapshot.write_changes(crawl, changes_path)
+
+    assert counts == {'added': 1, 'modified': 1, 'removed': 1, 'unchanged': 1, 'kept': 0}
+    assert feed(changes_path) == [('modified', '2'), ('added', '4'), ('removed', '3')]
+    assert sorted(snapshot.fingerprints) == ['1', '2', '4']
+
+
+def test_keep_ids_keeps_failed_products_out_of_removed(tmp_path):
+    snapshot = snapshot_of(PRODUCTS, str(tmp_path / 'snapshot.json'))
+    previous = dict(snapshot.fingerprints)
+    changes_path = str(tmp_path / 'changes.jsonl')
+
+    counts = snapshot.write_changes([PRODUCTS[0]], changes_path, keep_ids=['3'])
+
+    assert counts['removed'] == 1
+    assert counts['kept'] == 1
+    assert feed(changes_path) == [('removed', '2')]
+    assert snapshot.fingerprints == {'1': previous['1'], '3': previous['3']}
+
+
+def test_keep_missing_reports_nothing_removed(tmp_path):
+    snapshot = snapshot_of(PRODUCTS, str(tmp_path / 'snapshot.json'))
+    previous = dict(snapshot.fingerprints)
+    changes_path = str(tmp_path / 'changes.jsonl')
+
+    counts = snapshot.write_changes([dict(PRODUCTS[0], strength='1 g')], changes_path, keep_ids=['2'],
+                                    keep_missing=True)
+
+    assert counts == {'added': 0, 'modified': 1, 'removed': 0, 'unchanged': 0, 'kept': 2}
+    assert feed(changes_path) == [('modified', '1')]
+    assert snapshot.fingerprints['2'] == previous['2']
+    assert snapshot.fingerprints['3'] == previous['3']
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('bs4')
+
+import scraper  # noqa: E402
+
+WorkQueue = scraper.WorkQueue
+
+
+def open_queue(tmp_path, **kwargs):
+    return WorkQueue(str(tmp_path / 'work_queue.db'), **kwargs)
+
+
+def test_expired_lease_is_reclaimed_and_late_result_dropped(tmp_path):
+    queue = open_queue(tmp_path, lease_seconds=0.05)
+    queue.add(WorkQueue.INGREDIENT, 'ing-1', 1, {'name': 'Paracetamol'})
+
+    assert queue.lease('worker-a', 10) == [(WorkQueue.INGREDIENT, 'ing-1', None, {'name': 'Paracetamol'})]
+    assert queue.lease('worker-b', 10) == []
+    time.sleep(0.1)
+    assert [item_id for _, item_id, _, _ in queue.lease('worker-b', 10)] == ['ing-1']
+
+    # worker-a lost its lease, so its result is dropped; worker-b's counts.
+    assert queue.complete(WorkQueue.INGREDIENT, 'ing-1', 'worker-a', WorkQueue.DONE, {'by': 'a'}) is False
+    assert queue.complete(WorkQueue.INGREDIENT, 'ing-1', 'worker-b', WorkQueue.DONE, {'by': 'b'}) is True
+    assert [result for _, _, _, _, result in queue.results(WorkQueue.INGREDIENT)] == [{'by': 'b'}]
+    assert queue.outstanding() == 0
+
+
+def test_task_fails_after_max_attempts_expired_leases(tmp_path):
+    queue = open_queue(tmp_path, lease_seconds=0.05, max_attempts=2)
+    queue.add(WorkQueue.PRODUCT, '42', 1)
+
+    for _ in range(2):
+        assert len(queue.lease('worker', 10)) == 1
+        time.sleep(0.1)
+    assert queue.lease('worker', 10) == []
+    assert queue.counts() == {WorkQueue.FAILED: 1}
+
+
+def test_product_listed_under_several_ingredients_merges_under_the_first(tmp_path):
+    queue = open_queue(tmp_path)
+    queue.add(WorkQueue.INGREDIENT, 'ing-1', 1)
+    queue.add(WorkQueue.INGREDIENT, 'ing-2', 2)
+    queue.lease('worker', 10)
+
+    # The later ingredient finishes first and queues the shared product.
+    queue.complete(WorkQueue.INGREDIENT, 'ing-2', 'worker', WorkQueue.DONE,
+                   children=[(WorkQueue.PRODUCT, 'shared', {'n': 2}), (WorkQueue.PRODUCT, 'only-2', {'n': 2})])
+    queue.complete(WorkQueue.INGREDIENT, 'ing-1', 'worker', WorkQueue.DONE,
+                   children=[(WorkQueue.PRODUCT, 'only-1', {'n': 1}), (WorkQueue.PRODUCT, 'shared', {'n': 1})])
+
+    assert [(item_id, parent_id, payload) for item_id, _, parent_id, payload, _ in queue.results(WorkQueue.PRODUCT)] == [
+        ('only-1', 'ing-1', {'n': 1}),
+        ('shared', 'ing-1', {'n': 1}),
+        ('only-2', 'ing-2', {'n': 2}),
+    ]
+    # Leases follow the same order.
+    assert [item_id for _, item_id, _, _ in queue.lease('worker', 10)] == ['only-1', 'shared', 'only-2']